@@ -0,0 +1,181 @@
+import collections
+import threading
+import time
+
+class PendingAction:
+    """An action sent to a device, waiting for its acknowledgement."""
+    __slots__ = ('id', 'device', 'action', 'sent', 'deadline', 'acked')
+
+    def __init__(self, id, device, action, sent, deadline):
+        self.id = id
+        self.device = device
+        self.action = action
+        self.sent = sent
+        self.deadline = deadline
+        # Time of the acknowledgement, None until acknowledged
+        self.acked = None
+
+class AckTracker:
+    def __init__(self, logger, keep=3600):
+        """
+        Initialize the AckTracker.
+
+        Every signed action published to a device gets an ID, sent along
+        as "id". A device reports that it has carried out an action by
+        including the ID as "ack" in its next status message.
+
+        Recording an acknowledgement is a dictionary lookup, and status
+        messages without "ack" cost nothing. Actions are dropped, oldest
+        first, keep seconds after their deadline when new actions are
+        added.
+
+        Used by a single server process; see SharedAckTracker.
+
+        Args:
+            logger: Logger instance (optional)
+            keep: Seconds actions are kept after their deadline
+        """
+        self.logger = logger
+        self.keep = keep
+        self.cond = threading.Condition()
+        # action ID -> PendingAction
+        self.actions = {}
+        # PendingActions in the order they were sent
+        self.order = collections.deque()
+        self.last_id = 0
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def put(self, device, action, timeout):
+        """
+        Record an action about to be sent to a device (None for all
+        devices), to be acknowledged within timeout seconds. Returns the
+        action ID.
+        """
+        now = time.time()
+        with self.cond:
+            while self.order and self.order[0].deadline <= now - self.keep:
+                del self.actions[self.order.popleft().id]
+            self.last_id += 1
+            pending = PendingAction(self.last_id, device, action, now, now + timeout)
+            self.actions[pending.id] = pending
+            self.order.append(pending)
+            return pending.id
+
+    def ack(self, device, action_id):
+        """Record an acknowledgement from a device. Returns True if it matched a pending action."""
+        now = time.time()
+        with self.cond:
+            pending = self.actions.get(action_id) if isinstance(action_id, int) else None
+            if pending is None or pending.acked is not None or pending.deadline <= now or \
+                    pending.device not in (device, None):
+                pending = None
+            else:
+                pending.acked = now
+                self.cond.notify_all()
+        if pending is None:
+            self.log_info(f"AckTracker: unexpected ack {action_id} from {device}")
+            return False
+        self.log_info(f"AckTracker: {device} acknowledged '{pending.action}' ({action_id}) " +
+                      f"after {now - pending.sent:.2f}s")
+        return True
+
+    def wait(self, ids):
+        """
+        Wait until the actions have been acknowledged or their deadlines
+        have passed. Returns {action ID: seconds until acknowledged, or
+        None if not acknowledged in time}.
+        """
+        with self.cond:
+            pending = [self.actions[action_id] for action_id in ids]
+            deadline = max((p.deadline for p in pending), default=0)
+            while True:
+                remaining = deadline - time.time()
+                if all(p.acked is not None for p in pending) or remaining <= 0:
+                    return { p.id: None if p.acked is None else p.acked - p.sent for p in pending }
+                self.cond.wait(remaining)
+
+class SharedAckTracker:
+    def __init__(self, state, logger, keep=3600):
+        """
+        Initialize the SharedAckTracker.
+
+        AckTracker for several server processes: pending actions are kept
+        in the SharedState, so an action can be sent by any process and
+        the acknowledgement recorded by the one running the MQTT
+        subscriber. Recording an acknowledgement is a single update by ID.
+
+        Args:
+            state: SharedState
+            logger: Logger instance (optional)
+            keep: Seconds actions are kept after their deadline
+        """
+        self.state = state
+        self.logger = logger
+        self.keep = keep
+        state.create_tables("""
+            CREATE TABLE IF NOT EXISTS acs_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device TEXT,
+                action TEXT NOT NULL,
+                sent REAL NOT NULL,
+                deadline REAL NOT NULL,
+                acked REAL);
+            CREATE INDEX IF NOT EXISTS acs_actions_deadline ON acs_actions (deadline);
+        """)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def put(self, device, action, timeout):
+        """
+        Record an action about to be sent to a device (None for all
+        devices), to be acknowledged within timeout seconds. Returns the
+        action ID.
+        """
+        now = time.time()
+        with self.state.transaction() as db:
+            db.execute("DELETE FROM acs_actions WHERE deadline <= ?", (now - self.keep,))
+            return db.execute("""INSERT INTO acs_actions (device, action, sent, deadline) VALUES (?, ?, ?, ?)
+                                 RETURNING id""", (device, action, now, now + timeout)).fetchone()[0]
+
+    def ack(self, device, action_id):
+        """Record an acknowledgement from a device. Returns True if it matched a pending action."""
+        if not isinstance(action_id, int):
+            return False
+        now = time.time()
+        with self.state.transaction() as db:
+            row = db.execute("""UPDATE acs_actions SET acked = ?
+                                WHERE id = ? AND acked IS NULL AND deadline > ? AND (device = ? OR device IS NULL)
+                                RETURNING action, ? - sent""", (now, action_id, now, device, now)).fetchone()
+        if row is None:
+            self.log_info(f"AckTracker: unexpected ack {action_id} from {device}")
+            return False
+        self.log_info(f"AckTracker: {device} acknowledged '{row[0]}' ({action_id}) after {row[1]:.2f}s")
+        return True
+
+    def _acked(self, ids):
+        with self.state.connect() as db:
+            return dict(db.execute(f"""SELECT id, acked - sent FROM acs_actions
+                                       WHERE id IN ({','.join('?' * len(ids))}) AND acked IS NOT NULL""",
+                                   ids).fetchall())
+
+    def wait(self, ids):
+        """
+        Wait until the actions have been acknowledged or their deadlines
+        have passed. Returns {action ID: seconds until acknowledged, or
+        None if not acknowledged in time}.
+        """
+        ids = list(ids)
+        with self.state.connect() as db:
+            deadline = db.execute(f"SELECT MAX(deadline) FROM acs_actions WHERE id IN ({','.join('?' * len(ids))})",
+                                  ids).fetchone()[0] or 0
+        while True:
+            acked = self._acked(ids)
+            remaining = deadline - time.time()
+            if len(acked) == len(ids) or remaining <= 0:
+                return { action_id: acked.get(action_id) for action_id in ids }
+            self.state.wait(remaining)
@@ -0,0 +1,373 @@
+import array
+import collections
+import glob
+import gzip
+import mmap
+import os
+import re
+import threading
+import time
+import unicodedata
+
+# Rotated files are named acs.yyyy-mm-dd_HH, optionally gzip compressed
+ROTATED_RE = re.compile(r'^acs\.(\d{4}-\d{2}-\d{2})_(\d{2})(\.gz)?$')
+# Words as split by the SQLite full-text index (letters and digits)
+WORD_RE = re.compile(r'[^\W_]+')
+
+def read_reverse(path, block_size=65536):
+    """Yield the lines of a file from last to first, reading backwards in blocks."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b''
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + tail).split(b'\n')
+            # The first piece may be the end of a line in the previous block
+            tail = lines[0]
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line
+        if tail:
+            yield tail
+
+def parse_line(line):
+    """Split a 'time|device|message' line. Returns None for malformed lines."""
+    parts = line.decode('utf-8', errors='replace').rstrip('\n').split('|', 2)
+    if len(parts) != 3:
+        return None
+    return parts
+
+def format_entry(parts):
+    return f"{parts[0]} {parts[2]}\n"
+
+def fold(text):
+    """Lower case and remove diacritics, as the full-text index does."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def word_matcher(text):
+    """
+    Return a function that tells whether a message matches every word of
+    text at the start of a word, like a full-text index prefix query.
+    'door' matches 'Door opened' and 'doorbell' but not 'backdoor'.
+    """
+    phrases = [WORD_RE.findall(fold(word)) for word in text.split()]
+    phrases = [phrase for phrase in phrases if phrase]
+
+    def match(message):
+        folded = fold(message)
+        # Cheap check before splitting the message into words
+        if not all(phrase[0] in folded for phrase in phrases):
+            return False
+        words = WORD_RE.findall(folded)
+        for phrase in phrases:
+            n = len(phrase)
+            if not any(words[i:i + n - 1] == phrase[:-1] and words[i + n - 1].startswith(phrase[-1])
+                       for i in range(len(words) - n + 1)):
+                return False
+        return True
+    return match
+
+class DeviceIndex:
+    """Offsets of the lines for each device in a file that no longer changes."""
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.path = path
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.offsets = {}
+        if stat.st_size == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            size = len(mm)
+            while pos < size:
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    end = size
+                first = mm.find(b'|', pos, end)
+                second = mm.find(b'|', first + 1, end) if first >= 0 else -1
+                if second >= 0:
+                    device = mm[first + 1:second].decode('utf-8', errors='replace').lower()
+                    offsets = self.offsets.get(device)
+                    if offsets is None:
+                        offsets = self.offsets[device] = array.array('Q')
+                    offsets.append(pos)
+                pos = end + 1
+
+    def is_current(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return self.key == (stat.st_mtime_ns, stat.st_size)
+
+    def last_lines(self, device, count):
+        """Return the last count parsed lines for a device, oldest first."""
+        offsets = self.offsets.get(device.lower())
+        if not offsets or count <= 0:
+            return []
+        result = []
+        with open(self.path, 'rb') as f:
+            for offset in offsets[-count:]:
+                f.seek(offset)
+                result.append(parse_line(f.readline()))
+        return result
+
+class AcsLogQuery:
+    def __init__(self, log_dir, logger, max_indexes=8):
+        """
+        Initialize the AcsLogQuery.
+
+        Queries the log files written by acsmqttlogger: the current file
+        'acs' and rotated files 'acs.yyyy-mm-dd_HH'. The current file is read
+        backwards from the end; rotated files get a cached per-device index.
+
+        Args:
+            log_dir: Directory containing the log files
+            logger: Logger instance (optional)
+            max_indexes: Number of rotated file indexes to keep
+        """
+        self.log_dir = log_dir
+        self.logger = logger
+        self.max_indexes = max_indexes
+        self.indexes = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def current_file(self):
+        return os.path.join(self.log_dir, 'acs')
+
+    def rotated_files(self):
+        """Return the rotated log files, oldest first. Names sort chronologically."""
+        files = glob.glob(os.path.join(self.log_dir, 'acs.*'))
+        return sorted(f for f in files if not f.endswith('.gz'))
+
+    def history_files(self):
+        """
+        Return (stamp, path) for all log files, oldest first, including
+        compressed ones. Stamps are 'yyyy-mm-dd HH'; the current file has
+        stamp None.
+        """
+        files = []
+        for path in glob.glob(os.path.join(self.log_dir, 'acs.*')):
+            match = ROTATED_RE.match(os.path.basename(path))
+            if match:
+                files.append((f"{match.group(1)} {match.group(2)}", path))
+        files.sort()
+        if os.path.isfile(self.current_file()):
+            files.append((None, self.current_file()))
+        return files
+
+    def files_in_range(self, start, end):
+        """
+        Yield the paths of log files that may contain entries between start
+        and end (time prefixes, either may be None). The file name stamp may
+        be the start or end of the period a file covers, so a file is only
+        skipped if both neighbouring stamps are outside the range.
+        """
+        files = self.history_files()
+        for i, (stamp, path) in enumerate(files):
+            before = files[i - 1][0] if i > 0 else None
+            after = files[i + 1][0] if i + 1 < len(files) else None
+            if start is not None and after is not None and after < start:
+                continue
+            if end is not None and before is not None and before[:len(end)] > end:
+                continue
+            yield path
+
+    def search(self, device=None, start=None, end=None, text=None):
+        """
+        Yield parsed lines from all log files, oldest first, matching a device,
+        a time range (inclusive time prefixes such as '2026-10-13' or
+        '2026-10-13 18') and words at the start of words in the message
+        (see word_matcher()), as the log index does.
+        """
+        device = device.lower() if device else None
+        match = word_matcher(text) if text else None
+        for path in self.files_in_range(start, end):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rb') as f:
+                for line in f:
+                    parts = parse_line(line)
+                    if parts is None:
+                        continue
+                    if device is not None and parts[1].lower() != device:
+                        continue
+                    if start is not None and parts[0] < start:
+                        continue
+                    if end is not None and parts[0][:len(end)] > end:
+                        continue
+                    if match is not None and not match(parts[2]):
+                        continue
+                    yield parts
+
+    def get_index(self, path):
+        with self.lock:
+            index = self.indexes.get(path)
+            if index is not None and index.is_current():
+                self.indexes.move_to_end(path)
+                return index
+        self.log_info(f"Indexing {path}")
+        index = DeviceIndex(path)
+        with self.lock:
+            self.indexes[path] = index
+            while len(self.indexes) > self.max_indexes:
+                self.indexes.popitem(last=False)
+        return index
+
+    def last_entries(self, device, count):
+        """
+        Return the last count 'time message' lines for a device from the
+        newest rotated file and the current file, oldest first.
+        Returns None if there are no log files.
+        """
+        device = device.lower()
+        current = self.current_file()
+        rotated = self.rotated_files()
+        if not rotated and not os.path.isfile(current):
+            return None
+        found = []
+        if os.path.isfile(current):
+            for line in read_reverse(current):
+                if len(found) >= count:
+                    break
+                parts = parse_line(line)
+                if parts and parts[1].lower() == device:
+                    found.append(parts)
+            found.reverse()
+        if len(found) < count and rotated:
+            found = self.get_index(rotated[-1]).last_lines(device, count - len(found)) + found
+        return [format_entry(parts) for parts in found if parts]
+
+class AcsLogFollower:
+    def __init__(self, query, logger, max_lines=100, interval=1):
+        """
+        Initialize the AcsLogFollower.
+
+        Follows the current ACS log file like 'tail -F', detecting rotation,
+        and keeps the most recent lines for each device in memory.
+
+        Args:
+            query: AcsLogQuery for the same log directory
+            logger: Logger instance (optional)
+            max_lines: Number of lines kept per device
+            interval: Seconds between checks for new data
+        """
+        self.query = query
+        self.logger = logger
+        self.max_lines = max_lines
+        self.interval = interval
+        # device (lower case) -> deque of 'time message' lines
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.file = None
+        self.inode = None
+        self.partial = b''
+        self.running = False
+        self.thread = None
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _add(self, parts):
+        device = parts[1].lower()
+        with self.lock:
+            buffer = self.buffers.get(device)
+            if buffer is None:
+                buffer = self.buffers[device] = collections.deque(maxlen=self.max_lines)
+            buffer.append(format_entry(parts))
+
+    def _read_new(self):
+        """Add complete lines written since the last read."""
+        data = self.partial + self.file.read()
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            parts = parse_line(line)
+            if parts:
+                self._add(parts)
+
+    def _open(self):
+        path = self.query.current_file()
+        try:
+            self.file = open(path, 'rb')
+        except OSError:
+            self.file = None
+            return
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.partial = b''
+
+    def _check_rotation(self):
+        """Reopen the current file if it has been rotated or truncated."""
+        try:
+            stat = os.stat(self.query.current_file())
+        except OSError:
+            return
+        if self.file is None:
+            self._open()
+        elif stat.st_ino != self.inode or stat.st_size < self.file.tell():
+            # Finish the old file before switching
+            self._read_new()
+            self.file.close()
+            self.log_info("ACS log rotated")
+            self._open()
+
+    def load(self):
+        """Fill the buffers from the newest rotated file and the current file."""
+        rotated = self.query.rotated_files()
+        if rotated:
+            index = self.query.get_index(rotated[-1])
+            for device in index.offsets:
+                for parts in index.last_lines(device, self.max_lines):
+                    if parts:
+                        self._add(parts)
+        self._open()
+        if self.file is not None:
+            self._read_new()
+        self.log_info(f"ACS log buffers loaded for {len(self.buffers)} devices")
+
+    def last_entries(self, device, count):
+        """
+        Return the last count lines for a device, oldest first, or None if
+        more lines are requested than are kept in memory.
+        """
+        if not self.running or count > self.max_lines:
+            return None
+        with self.lock:
+            buffer = self.buffers.get(device.lower())
+            if buffer is None:
+                return []
+            return list(buffer)[-count:] if count > 0 else []
+
+    def _follow_loop(self):
+        """Main loop for the follower thread."""
+        while self.running:
+            try:
+                self._check_rotation()
+                if self.file is not None:
+                    self._read_new()
+            except Exception as e:
+                self.log_info(f"AcsLogFollower exception: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Load the buffers and start the follower thread."""
+        if self.running:
+            return
+        self.load()
+        self.running = True
+        self.thread = threading.Thread(target=self._follow_loop, name="acslog-follower", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the follower thread."""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,79 @@
+"""
+Per-call latency of one-shot requests.post versus a pooled keep-alive session,
+measured against a local HTTPS stub with a self-signed certificate.
+
+Usage: python benchmarks/bench_http.py [calls]
+Requires the openssl command line tool.
+"""
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from httpsession import make_session
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Avoid Nagle/delayed-ACK stalls dominating the measurement
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub(certdir):
+    cert = os.path.join(certdir, 'cert.pem')
+    key = os.path.join(certdir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                    '-keyout', key, '-out', cert, '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost'],
+                   check=True, capture_output=True)
+    server = ThreadingHTTPServer(('localhost', 0), StubHandler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert
+
+def measure(post, url, cert, calls):
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        r = post(url, json={"log": {"message": f"entry {i}"}}, verify=cert)
+        r.raise_for_status()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def report(name, timings):
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:>14}: mean {statistics.mean(timings):6.2f} ms, "
+          f"median {statistics.median(timings):6.2f} ms, p95 {p95:6.2f} ms")
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as certdir:
+        server, cert = start_stub(certdir)
+        url = f"https://localhost:{server.server_address[1]}/api/v1/logs"
+        report("requests.post", measure(requests.post, url, cert, calls))
+        session = make_session()
+        report("pooled session", measure(session.post, url, cert, calls))
+        server.shutdown()
@@ -0,0 +1,60 @@
+"""
+/lastlog latency with a year of synthetic ACS logs: file scan (AcsLogQuery)
+versus the SQLite index (AcsLogIndex).
+
+Usage: python benchmarks/bench_lastlog.py [lines_per_day]
+"""
+import datetime
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from acslog import AcsLogQuery
+from logindex import AcsLogIndex
+
+DEVICES = ['main', 'barndoor', 'woodshop', 'tester', 'laser', 'lathe', 'cnc', 'printer']
+
+def write_logs(log_dir, lines_per_day):
+    day = datetime.datetime(2025, 10, 18)
+    for n in range(366):
+        name = 'acs' if n == 365 else f"acs.{day:%Y-%m-%d}_00"
+        with open(os.path.join(log_dir, name), 'w') as f:
+            for i in range(lines_per_day):
+                stamp = day + datetime.timedelta(seconds=i * 86400 // lines_per_day)
+                device = random.choice(DEVICES)
+                f.write(f"{stamp:%Y-%m-%d %H:%M:%S}|{device}|Granted entry for card {random.randrange(10**8):08d}\n")
+        day += datetime.timedelta(days=1)
+
+def measure(func, runs=50):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+if __name__ == '__main__':
+    lines_per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as log_dir:
+        write_logs(log_dir, lines_per_day)
+        query = AcsLogQuery(log_dir, None)
+        index = AcsLogIndex(os.path.join(log_dir, 'index', 'acslog.db'), query, None)
+        start = time.perf_counter()
+        count = index.update()
+        print(f"Indexed {count} lines in {time.perf_counter() - start:.1f} s")
+        for lines in [5, 50]:
+            print(f"/lastlog main {lines}:")
+            print(f"{'file scan':>14}: {measure(lambda: query.last_entries('main', lines)):8.3f} ms")
+            print(f"{'sqlite index':>14}: {measure(lambda: index.last_entries('main', lines)):8.3f} ms")
+        print("/acslogsearch device=woodshop from=2026-03-03 to=2026-03-04 card:")
+        scan = lambda: list(itertools.islice(query.search('woodshop', '2026-03-03', '2026-03-04', 'card'), 26))
+        print(f"{'file scan':>14}: {measure(scan, 5):8.3f} ms")
+        print(f"{'sqlite index':>14}: {measure(lambda: index.search('woodshop', '2026-03-03', '2026-03-04', 'card', 0, 26)):8.3f} ms")
+        print("/acslogsearch 12345:")
+        print(f"{'sqlite fts':>14}: {measure(lambda: index.search(text='12345')):8.3f} ms")
+        print(f"{'incremental':>14}: {measure(index.update):8.3f} ms (no new lines)")
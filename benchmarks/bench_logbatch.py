@@ -0,0 +1,39 @@
+"""
+Throughput of access log delivery through the outbox at different batch
+sizes, against the local Panopticon stand-in.
+
+Usage: python benchmarks/bench_logbatch.py [entries] [latency_ms]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import panopticon_stub
+from httpsession import make_session
+from outbox import Outbox
+
+def run(server, entries, batch_size, bulk):
+    base = f"http://localhost:{server.server_address[1]}/api/v1"
+    bulk_urls = { f"{base}/logs": f"{base}/logs/bulk" } if bulk else {}
+    with tempfile.TemporaryDirectory() as spool:
+        outbox = Outbox(os.path.join(spool, 'outbox.db'), make_session(), 'token', None,
+                        bulk_urls=bulk_urls, batch_size=batch_size, max_age=0)
+        for i in range(entries):
+            outbox.append(f"{base}/logs", { "log": { "message": f"Laser cutter entry {i}" } })
+        start = time.perf_counter()
+        ok, _ = outbox.drain()
+        elapsed = time.perf_counter() - start
+        assert ok and outbox.pending() == 0
+    return entries / elapsed
+
+if __name__ == '__main__':
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    server = panopticon_stub.start(latency=latency / 1000)
+    print(f"{entries} entries, {latency} ms server latency")
+    print(f"{'single posts':>16}: {run(server, entries, 50, False):8.1f} logs/s")
+    for batch_size in [10, 50, 200]:
+        print(f"{f'batch {batch_size}':>16}: {run(server, entries, batch_size, True):8.1f} logs/s")
+    server.shutdown()
@@ -0,0 +1,107 @@
+"""
+Serving throughput: the werkzeug development server versus the production
+mode (gunicorn gthread workers sharing state through SQLite). The
+development server keeps its state in memory.
+
+Each server runs in its own process without MQTT. Client processes, each
+with several keep-alive sessions, poll /spaceapi (read only) and /camctl
+(writes the camera power status to the shared state on every request), as
+the SpaceAPI directory and the camera power controllers do.
+
+Usage: python benchmarks/bench_serving.py [seconds] [client processes] [threads per client]
+"""
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ENV = dict(os.environ, CAMCTL_VERIFICATION_TOKEN='bench', ACS_VERIFICATION_TOKEN='bench')
+for name in ['MQTT_KEY', 'MQTT_USER', 'MQTT_PASSWORD', 'ACS_DOOR_TOKEN', 'SLACK_WRITE_TOKEN']:
+    ENV.setdefault(name, '00')
+
+def serve(mode, port, workers, threads):
+    sys.path.insert(0, ROOT)
+    os.environ['WORKERS'] = str(workers if mode == 'gunicorn' else 0)
+    import service
+    if mode == 'dev':
+        from werkzeug.serving import make_server
+        make_server('localhost', port, service.app, threaded=True).serve_forever()
+    else:
+        from wsgiserver import WsgiServer
+        sys.argv = sys.argv[:1]
+        WsgiServer(service.app, f'localhost:{port}', workers, threads,
+                   service.app.event_relay.start).run()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def poll(url, headers, seconds, threads, result):
+    count = [0] * threads
+    stop = time.monotonic() + seconds
+
+    def run(n):
+        session = requests.Session()
+        while time.monotonic() < stop:
+            r = session.get(url, headers=headers)
+            if r.status_code != 200:
+                raise RuntimeError(f"{url}: {r.status_code}")
+            count[n] += 1
+
+    pool = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    result.put(sum(count))
+
+def measure(url, headers, seconds, clients, threads):
+    result = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=poll, args=(url, headers, seconds, threads, result))
+             for _ in range(clients)]
+    for p in procs:
+        p.start()
+    total = sum(result.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return total / seconds
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]))
+        sys.exit(0)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    servers = [
+        ("dev server", 'dev', 1, 1),
+        ("gunicorn 1x16", 'gunicorn', 1, 16),
+        ("gunicorn 4x4", 'gunicorn', 4, 4),
+    ]
+    for name, mode, workers, server_threads in servers:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, 'serve', mode, str(port), str(workers), str(server_threads)],
+                                  env=ENV, stderr=subprocess.DEVNULL)
+        base = f"http://localhost:{port}"
+        for _ in range(100):
+            try:
+                requests.get(f"{base}/spaceapi")
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        cases = [
+            ("/spaceapi", f"{base}/spaceapi", { 'Accept-Encoding': 'identity' }),
+            ("/camctl", f"{base}/camctl?cameras=1&version=bench", { 'Authentication': 'Bearer bench' }),
+        ]
+        for case, url, headers in cases:
+            rate = measure(url, headers, seconds, clients, threads)
+            print(f"{name:>14} {case:>10}: {rate:8.0f} requests/s")
+        server.terminate()
+        server.wait()
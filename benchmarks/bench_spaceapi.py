@@ -0,0 +1,67 @@
+"""
+/spaceapi throughput: rebuilding the document with jsonify on every request
+versus the pre-serialized body, with and without gzip and If-None-Match.
+
+Runs the service's Flask app in a threaded werkzeug server and polls it from
+several client threads with keep-alive sessions.
+
+Usage: python benchmarks/bench_spaceapi.py [seconds] [clients]
+"""
+import os
+import sys
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+for name in ['MQTT_KEY', 'MQTT_USER', 'MQTT_PASSWORD', 'ACS_DOOR_TOKEN', 'SLACK_WRITE_TOKEN']:
+    os.environ.setdefault(name, '00')
+import service
+from flask import jsonify
+from flask_cors import cross_origin
+from spaceapi import SPACEAPI_INFO
+
+@service.app.route('/spaceapi-legacy', methods=['GET'])
+@cross_origin()
+def spaceapi_legacy():
+    info = dict(SPACEAPI_INFO, state=service.app.spaceapi.space())
+    return jsonify(info)
+
+def run(url, headers, seconds, clients):
+    count = [0] * clients
+    stop = time.monotonic() + seconds
+
+    def poll(n):
+        session = requests.Session()
+        while time.monotonic() < stop:
+            r = session.get(url, headers=headers)
+            if r.status_code not in (200, 304):
+                raise RuntimeError(f"{url}: {r.status_code}")
+            count[n] += 1
+
+    threads = [threading.Thread(target=poll, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(count) / seconds
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    server = make_server('localhost', 0, service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://localhost:{server.server_port}"
+    etag = requests.get(f"{base}/spaceapi").headers['ETag']
+    cases = [
+        ("jsonify", f"{base}/spaceapi-legacy", { 'Accept-Encoding': 'identity' }),
+        ("cached", f"{base}/spaceapi", { 'Accept-Encoding': 'identity' }),
+        ("cached gzip", f"{base}/spaceapi", { 'Accept-Encoding': 'gzip' }),
+        ("304", f"{base}/spaceapi", { 'If-None-Match': etag }),
+    ]
+    for name, url, headers in cases:
+        size = len(requests.get(url, headers=headers, stream=True).raw.read())
+        print(f"{name:>12}: {run(url, headers, seconds, clients):8.0f} requests/s, {size:4d} body bytes")
+    server.shutdown()
@@ -0,0 +1,79 @@
+"""
+Local stand-in for the Panopticon API, for benchmarks and manual testing.
+
+Accepts POSTs to /api/v1/logs, /api/v1/logs/delegate, /api/v1/unknown_cards
+and the batch endpoints /api/v1/logs/bulk and /api/v1/logs/delegate/bulk.
+Each request takes at least --latency milliseconds, to model the round trip
+to the real server.
+
+Usage: python benchmarks/panopticon_stub.py [--port 8000] [--latency 20] [--no-bulk]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SINGLE_PATHS = ['/api/v1/logs', '/api/v1/logs/delegate', '/api/v1/unknown_cards']
+BULK_PATHS = ['/api/v1/logs/bulk', '/api/v1/logs/delegate/bulk']
+
+class PanopticonStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.02, bulk=True):
+        super().__init__(address, PanopticonHandler)
+        self.latency = latency
+        self.bulk = bulk
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.entries = 0
+
+    def count(self, entries):
+        with self.lock:
+            self.requests += 1
+            self.entries += entries
+
+class PanopticonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.server.latency)
+        if self.path in SINGLE_PATHS:
+            self.server.count(1)
+            self.reply(201)
+        elif self.path in BULK_PATHS and self.server.bulk:
+            self.server.count(len(body.get('batch', [])))
+            self.reply(201)
+        else:
+            self.reply(404)
+
+    def reply(self, status):
+        body = b'{}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start(port=0, latency=0.02, bulk=True):
+    """Start a stub server in a background thread and return it."""
+    server = PanopticonStub(('localhost', port), latency, bulk)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Panopticon API stand-in")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds per request")
+    parser.add_argument("--no-bulk", action="store_true", help="reject batch requests")
+    args = parser.parse_args()
+    server = PanopticonStub(('localhost', args.port), args.latency / 1000, not args.no_bulk)
+    print(f"Panopticon stub listening on http://localhost:{args.port}/api/v1")
+    server.serve_forever()
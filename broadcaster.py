@@ -0,0 +1,268 @@
+import collections
+import itertools
+import json
+import threading
+import time
+
+# Comment line sent on idle streams, so proxies do not time them out
+KEEPALIVE = b": keep-alive\n\n"
+
+class Subscriber:
+    """Position of one client in the event stream (sequence number of the last event sent)."""
+    __slots__ = ('cursor',)
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+class EventBroadcaster:
+    def __init__(self, logger, backlog=256, max_subscribers=2000, heartbeat=15, private_events=()):
+        """
+        Initialize the EventBroadcaster.
+
+        Fans out Server-Sent Events to any number of subscribers. Each event
+        is encoded once and appended to a shared ring of recent events;
+        subscribers only hold their position in the ring, so publishing
+        costs the same no matter how many clients are connected. Clients
+        are served either by stream(), a thread each, or by an EventServer,
+        which reads for all of its subscribers from one thread.
+
+        A subscriber that falls more than backlog events behind (e.g. a
+        client that stopped reading and blocked its socket) is disconnected
+        instead of buffering for it. Clients reconnecting with Last-Event-ID
+        resume where they left off if the ring still has those events.
+
+        Events named in private_events are only sent to subscribers that
+        have authenticated; the others skip them.
+
+        Args:
+            logger: Logger instance (optional)
+            backlog: Number of recent events kept for slow and reconnecting clients
+            max_subscribers: Maximum number of connected clients
+            heartbeat: Seconds between keep-alive comments on an idle stream
+            private_events: Names of the events only sent to authenticated subscribers
+        """
+        self.logger = logger
+        self.backlog = backlog
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.private_events = frozenset(private_events)
+        # Called on every publish, e.g. to wake an EventServer
+        self.listeners = []
+        self.cond = threading.Condition()
+        # (sequence number, event id, encoded event, public), oldest first.
+        # Sequence numbers are local and contiguous; event IDs are sent to clients.
+        self.events = collections.deque(maxlen=backlog)
+        self.seq = 0
+        self.last_id = 0
+        self.subscribers = 0
+        self.running = True
+        self.published = 0
+        self.dropped = 0
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    @staticmethod
+    def encode(event, data, event_id=None):
+        """Return an SSE frame for an event with JSON data."""
+        frame = f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+        if event_id is not None:
+            frame = f"id: {event_id}\n{frame}"
+        return frame.encode('utf-8')
+
+    def publish(self, event, data, event_id=None):
+        """
+        Send an event to all subscribers. Never blocks on clients.
+        Event IDs must increase; by default the next ID is used.
+        """
+        with self.cond:
+            self.seq += 1
+            self.last_id = self.last_id + 1 if event_id is None else event_id
+            self.events.append((self.seq, self.last_id, self.encode(event, data, self.last_id),
+                                event not in self.private_events))
+            self.published += 1
+            self.cond.notify_all()
+            for callback in self.listeners:
+                callback()
+
+    def is_full(self):
+        with self.cond:
+            return self.subscribers >= self.max_subscribers
+
+    def add_listener(self, callback):
+        """
+        Call callback() whenever an event is published or the broadcaster
+        stops. Called with the lock held, so it must not block.
+        """
+        with self.cond:
+            self.listeners.append(callback)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Add a subscriber, positioned after last_event_id if the ring still
+        has the events after it, otherwise at the newest event. Returns the
+        Subscriber, or None if there are too many subscribers.
+        """
+        with self.cond:
+            if self.subscribers >= self.max_subscribers:
+                self.log_info("EventBroadcaster: too many subscribers")
+                return None
+            self.subscribers += 1
+            subscriber = Subscriber(self.seq)
+            if last_event_id is not None and self.events and \
+                    self.events[0][1] - 1 <= last_event_id < self.last_id:
+                # Resume after the last event the client has seen
+                subscriber.cursor = self.events[0][0] - 1
+                for seq, event_id, _, _ in self.events:
+                    if event_id > last_event_id:
+                        break
+                    subscriber.cursor = seq
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.cond:
+            self.subscribers -= 1
+
+    def read(self, subscriber, private=False):
+        """
+        Return the frames published since the subscriber last read (private
+        events only if private is True), b'' if there are none, or None if
+        the subscriber fell too far behind or the broadcaster was stopped.
+        Never blocks on clients.
+        """
+        with self.cond:
+            if not self.running:
+                return None
+            if subscriber.cursor == self.seq:
+                return b''
+            if self.events[0][0] > subscriber.cursor + 1:
+                # Events this client has not seen were already overwritten
+                self.dropped += 1
+                self.log_info(f"EventBroadcaster: dropping slow subscriber at event {subscriber.cursor}")
+                return None
+            start = subscriber.cursor + 1 - self.events[0][0]
+            subscriber.cursor = self.seq
+            return b''.join(frame for _, _, frame, public in itertools.islice(self.events, start, None)
+                            if public or private)
+
+    def stream(self, last_event_id=None, initial=(), private=False):
+        """
+        Generate the byte chunks for a client's response: the initial
+        frames, then events as they are published (private events only if
+        private is True), with keep-alive comments while idle. Holds the
+        calling thread for as long as the client stays connected. Resumes
+        after last_event_id if the ring still has the events after it. Ends
+        when the client falls too far behind, there are too many
+        subscribers, or the broadcaster is stopped.
+        """
+        subscriber = self.subscribe(last_event_id)
+        if subscriber is None:
+            return
+        try:
+            yield b"retry: 3000\n\n" + b''.join(initial)
+            written = time.monotonic()
+            while True:
+                with self.cond:
+                    if subscriber.cursor == self.seq and self.running:
+                        self.cond.wait(max(0, written + self.heartbeat - time.monotonic()))
+                    chunk = self.read(subscriber, private)
+                if chunk is None:
+                    return
+                if not chunk:
+                    if time.monotonic() - written < self.heartbeat:
+                        # Only events this client does not get
+                        continue
+                    chunk = KEEPALIVE
+                # Written outside the lock, so a slow client only holds up itself
+                yield chunk
+                written = time.monotonic()
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'subscribers': self.subscribers,
+                'published': self.published,
+                'dropped': self.dropped,
+            }
+
+    def stop(self):
+        """Disconnect all subscribers."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            for callback in self.listeners:
+                callback()
+
+class EventRelay:
+    def __init__(self, state, broadcaster, logger, keep=1000):
+        """
+        Initialize the EventRelay.
+
+        With several server processes, events are published to a table in
+        the SharedState by the process that receives them (the MQTT
+        subscriber), and each process relays them to its own
+        EventBroadcaster. Events keep their table IDs, so a client can
+        resume with Last-Event-ID on any process.
+
+        Args:
+            state: SharedState
+            broadcaster: EventBroadcaster of this process
+            logger: Logger instance (optional)
+            keep: Number of recent events kept in the table
+        """
+        self.state = state
+        self.broadcaster = broadcaster
+        self.logger = logger
+        self.keep = keep
+        self.running = False
+        self.thread = None
+        state.create_tables("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL);
+        """)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def publish(self, event, data):
+        """Send an event to the subscribers of all processes."""
+        with self.state.transaction() as db:
+            event_id = db.execute("INSERT INTO events (event, data) VALUES (?, ?) RETURNING id",
+                                  (event, json.dumps(data))).fetchone()[0]
+            db.execute("DELETE FROM events WHERE id <= ?", (event_id - self.keep,))
+
+    def _relay_loop(self):
+        """Main loop for the relay thread."""
+        with self.state.connect() as db:
+            last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        while self.running:
+            try:
+                with self.state.connect() as db:
+                    rows = db.execute("SELECT id, event, data FROM events WHERE id > ? ORDER BY id",
+                                      (last_id,)).fetchall()
+                for event_id, event, data in rows:
+                    self.broadcaster.publish(event, json.loads(data), event_id)
+                    last_id = event_id
+                if not rows:
+                    self.state.wait(1)
+            except Exception as e:
+                self.log_info(f"EventRelay exception: {e}")
+                time.sleep(1)
+
+    def start(self):
+        """Start the relay thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._relay_loop, name="event-relay", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the relay thread."""
+        self.running = False
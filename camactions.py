@@ -0,0 +1,236 @@
+import collections
+import itertools
+import threading
+import time
+
+class CameraAction:
+    """An action queued for one camera."""
+    __slots__ = ('id', 'action', 'created', 'delivered')
+
+    def __init__(self, id, action, created):
+        self.id = id
+        self.action = action
+        self.created = created
+        # Time of the last delivery, None if not delivered yet
+        self.delivered = None
+
+class CameraActionQueue:
+    def __init__(self, logger, ttl=3600, ack_timeout=60, max_per_camera=16):
+        """
+        Initialize the CameraActionQueue.
+
+        Keeps a separate queue of actions for each camera instance, so a
+        camera only ever looks at its own queue. Cameras fetch their
+        pending actions (optionally long-polling until one is queued) and
+        acknowledge them once carried out. Unacknowledged actions are
+        delivered again after ack_timeout, and actions that have not been
+        acknowledged within ttl are dropped.
+
+        Used by a single server process; see SharedCameraActionQueue.
+
+        Args:
+            logger: Logger instance (optional)
+            ttl: Seconds before an unacknowledged action expires
+            ack_timeout: Seconds before a delivered action is delivered again
+            max_per_camera: Maximum queued actions per camera; the oldest is
+                            dropped when a camera's queue is full
+        """
+        self.logger = logger
+        self.ttl = ttl
+        self.ack_timeout = ack_timeout
+        self.max_per_camera = max_per_camera
+        self.lock = threading.Lock()
+        # instance -> deque of CameraAction, oldest first
+        self.queues = {}
+        # instance -> [Condition on self.lock, number of waiters], for the
+        # cameras currently long-polling, so only that camera is woken
+        self.conds = {}
+        self.ids = itertools.count(1)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _wait(self, instance, timeout):
+        """Wait for an action for a camera. Called with the lock held."""
+        waiting = self.conds.get(instance)
+        if waiting is None:
+            waiting = self.conds[instance] = [threading.Condition(self.lock), 0]
+        waiting[1] += 1
+        try:
+            waiting[0].wait(timeout)
+        finally:
+            waiting[1] -= 1
+            if not waiting[1]:
+                del self.conds[instance]
+
+    def _expire(self, instance, now):
+        """Drop expired actions for a camera. Called with the lock held."""
+        queue = self.queues.get(instance)
+        while queue and queue[0].created + self.ttl <= now:
+            expired = queue.popleft()
+            self.log_info(f"Camera action '{expired.action}' for instance {instance} expired")
+        if queue is not None and not queue:
+            del self.queues[instance]
+
+    def put(self, instance, action):
+        """Queue an action for a camera. Returns the action ID."""
+        with self.lock:
+            queue = self.queues.get(instance)
+            if queue is None:
+                queue = self.queues[instance] = collections.deque()
+            if len(queue) >= self.max_per_camera:
+                dropped = queue.popleft()
+                self.log_info(f"Camera action queue for instance {instance} full, dropping '{dropped.action}'")
+            item = CameraAction(next(self.ids), action, time.time())
+            queue.append(item)
+            waiting = self.conds.get(instance)
+            if waiting:
+                waiting[0].notify_all()
+            return item.id
+
+    def _due(self, instance, now):
+        """Return the actions to deliver now. Called with the lock held."""
+        self._expire(instance, now)
+        return [item for item in self.queues.get(instance, ())
+                if item.delivered is None or item.delivered + self.ack_timeout <= now]
+
+    def fetch(self, instance, timeout=0):
+        """
+        Return [(id, action)] for the actions a camera has not received or
+        not acknowledged in time, oldest first. If there are none, wait up
+        to timeout seconds for one to be queued.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                now = time.time()
+                due = self._due(instance, now)
+                remaining = deadline - time.monotonic()
+                if due or remaining <= 0:
+                    break
+                self._wait(instance, remaining)
+            for item in due:
+                item.delivered = now
+            return [(item.id, item.action) for item in due]
+
+    def ack(self, instance, ids):
+        """Remove acknowledged actions. Returns the number removed."""
+        ids = set(i for i in ids if isinstance(i, int))
+        with self.lock:
+            queue = self.queues.get(instance)
+            if not queue:
+                return 0
+            kept = collections.deque(item for item in queue if item.id not in ids)
+            removed = len(queue) - len(kept)
+            if kept:
+                self.queues[instance] = kept
+            else:
+                del self.queues[instance]
+            return removed
+
+    def pending(self, instance):
+        """Return the number of unacknowledged actions for a camera."""
+        with self.lock:
+            self._expire(instance, time.time())
+            return len(self.queues.get(instance, ()))
+
+class SharedCameraActionQueue:
+    def __init__(self, state, logger, ttl=3600, ack_timeout=60, max_per_camera=16):
+        """
+        Initialize the SharedCameraActionQueue.
+
+        CameraActionQueue for several server processes: the queues are kept
+        in the SharedState (indexed on instance), so actions can be queued
+        and fetched by any process. Long-polls check for new actions every
+        SharedState poll interval.
+
+        Args:
+            state: SharedState
+            logger: Logger instance (optional)
+            ttl: Seconds before an unacknowledged action expires
+            ack_timeout: Seconds before a delivered action is delivered again
+            max_per_camera: Maximum queued actions per camera; the oldest is
+                            dropped when a camera's queue is full
+        """
+        self.state = state
+        self.logger = logger
+        self.ttl = ttl
+        self.ack_timeout = ack_timeout
+        self.max_per_camera = max_per_camera
+        state.create_tables("""
+            CREATE TABLE IF NOT EXISTS camera_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                instance INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                created REAL NOT NULL,
+                delivered REAL);
+            CREATE INDEX IF NOT EXISTS camera_actions_instance ON camera_actions (instance, id);
+        """)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _expire(self, db, instance, now):
+        """Drop expired actions for a camera. Called in a transaction."""
+        for (action,) in db.execute("DELETE FROM camera_actions WHERE instance = ? AND created <= ? RETURNING action",
+                                    (instance, now - self.ttl)).fetchall():
+            self.log_info(f"Camera action '{action}' for instance {instance} expired")
+
+    def put(self, instance, action):
+        """Queue an action for a camera. Returns the action ID."""
+        now = time.time()
+        with self.state.transaction() as db:
+            self._expire(db, instance, now)
+            count = db.execute("SELECT COUNT(*) FROM camera_actions WHERE instance = ?", (instance,)).fetchone()[0]
+            if count >= self.max_per_camera:
+                dropped = db.execute("""DELETE FROM camera_actions WHERE id =
+                                        (SELECT MIN(id) FROM camera_actions WHERE instance = ?)
+                                        RETURNING action""", (instance,)).fetchone()
+                self.log_info(f"Camera action queue for instance {instance} full, dropping '{dropped[0]}'")
+            return db.execute("INSERT INTO camera_actions (instance, action, created) VALUES (?, ?, ?) RETURNING id",
+                              (instance, action, now)).fetchone()[0]
+
+    def _take_due(self, instance):
+        """Mark the actions to deliver now as delivered and return them."""
+        now = time.time()
+        due = "instance = ? AND (delivered IS NULL OR delivered <= ?)"
+        with self.state.connect() as db:
+            if db.execute(f"SELECT 1 FROM camera_actions WHERE {due} LIMIT 1",
+                          (instance, now - self.ack_timeout)).fetchone() is None:
+                return []
+        with self.state.transaction() as db:
+            self._expire(db, instance, now)
+            rows = db.execute(f"UPDATE camera_actions SET delivered = ? WHERE {due} RETURNING id, action",
+                              (now, instance, now - self.ack_timeout)).fetchall()
+        return sorted(rows)
+
+    def fetch(self, instance, timeout=0):
+        """
+        Return [(id, action)] for the actions a camera has not received or
+        not acknowledged in time, oldest first. If there are none, wait up
+        to timeout seconds for one to be queued.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            due = self._take_due(instance)
+            remaining = deadline - time.monotonic()
+            if due or remaining <= 0:
+                return due
+            self.state.wait(remaining)
+
+    def ack(self, instance, ids):
+        """Remove acknowledged actions. Returns the number removed."""
+        ids = [i for i in ids if isinstance(i, int)]
+        if not ids:
+            return 0
+        with self.state.transaction() as db:
+            return db.execute(f"DELETE FROM camera_actions WHERE instance = ? AND id IN ({','.join('?' * len(ids))})",
+                              [instance] + ids).rowcount
+
+    def pending(self, instance):
+        """Return the number of unacknowledged actions for a camera."""
+        with self.state.transaction() as db:
+            self._expire(db, instance, time.time())
+            return db.execute("SELECT COUNT(*) FROM camera_actions WHERE instance = ?", (instance,)).fetchone()[0]
@@ -0,0 +1,128 @@
+import threading
+import time
+
+# Delivered first
+SOURCES = ['slack', 'acs']
+
+class CamctlActions:
+    def __init__(self):
+        """
+        Initialize the CamctlActions.
+
+        Holds the pending camera power action for the camera power
+        controller: one set from Slack (/camctl) and one set by ACS
+        (/acscamctl). The Slack action is delivered first. Each action is
+        delivered once; a newer action from the same source replaces an
+        undelivered one.
+
+        The controller may long-poll: take() waits until an action is
+        queued, so it is delivered immediately instead of on the next poll.
+
+        Used by a single server process; see SharedCamctlActions.
+        """
+        self.cond = threading.Condition()
+        self.slack_action = None
+        self.acs_action = None
+        # Last status line reported by the controller
+        self.status = None
+
+    def set_status(self, status):
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+    def put_slack(self, action):
+        with self.cond:
+            self.slack_action = action
+            self.cond.notify_all()
+
+    def put_acs(self, action):
+        with self.cond:
+            self.acs_action = action
+            self.cond.notify_all()
+
+    def _pop(self):
+        """Remove and return the next action, or None. Called with the lock held."""
+        action = self.slack_action
+        if action:
+            self.slack_action = None
+            return action
+        action = self.acs_action
+        self.acs_action = None
+        return action or None
+
+    def take(self, timeout=0):
+        """
+        Remove and return the next action. If there is none, wait up to
+        timeout seconds for one. Returns None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                action = self._pop()
+                remaining = deadline - time.monotonic()
+                if action or remaining <= 0:
+                    return action
+                self.cond.wait(remaining)
+
+class SharedCamctlActions:
+    def __init__(self, state):
+        """
+        Initialize the SharedCamctlActions.
+
+        CamctlActions for several server processes: actions and the
+        controller status are kept in the SharedState, so they can be
+        queued and taken by any process. Long-polls check for new actions
+        every SharedState poll interval.
+
+        Args:
+            state: SharedState
+        """
+        self.state = state
+        state.create_tables("""
+            CREATE TABLE IF NOT EXISTS camctl (
+                source TEXT PRIMARY KEY,
+                action TEXT NOT NULL);
+        """)
+
+    def set_status(self, status):
+        self.state.set('camctl_status', status)
+
+    def get_status(self):
+        return self.state.get('camctl_status')[0]
+
+    def _put(self, source, action):
+        with self.state.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO camctl (source, action) VALUES (?, ?)", (source, action))
+
+    def put_slack(self, action):
+        self._put('slack', action)
+
+    def put_acs(self, action):
+        self._put('acs', action)
+
+    def _pop(self):
+        """Remove and return the next action, or None."""
+        with self.state.connect() as db:
+            if db.execute("SELECT 1 FROM camctl LIMIT 1").fetchone() is None:
+                return None
+        with self.state.transaction() as db:
+            for source in SOURCES:
+                row = db.execute("DELETE FROM camctl WHERE source = ? RETURNING action", (source,)).fetchone()
+                if row is not None:
+                    return row[0]
+        return None
+
+    def take(self, timeout=0):
+        """
+        Remove and return the next action. If there is none, wait up to
+        timeout seconds for one. Returns None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            action = self._pop()
+            remaining = deadline - time.monotonic()
+            if action or remaining <= 0:
+                return action
+            self.state.wait(remaining)
@@ -0,0 +1,59 @@
+import collections
+import threading
+import time
+
+class DedupeCache:
+    def __init__(self, ttl, max_entries=10000):
+        """
+        Initialize the DedupeCache.
+
+        Remembers keys for ttl seconds, so redelivered messages can be
+        recognized. The oldest keys are evicted when max_entries is reached.
+
+        Args:
+            ttl: Seconds a key is remembered
+            max_entries: Maximum number of remembered keys
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> expiry time; insertion order is expiry order
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expire(self, now):
+        while self.entries:
+            key, expiry = next(iter(self.entries.items()))
+            if expiry > now:
+                break
+            del self.entries[key]
+
+    def seen(self, key):
+        """
+        Return True if key was seen within the last ttl seconds.
+        Otherwise remember it and return False.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            if key in self.entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            if len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.entries[key] = now + self.ttl
+            return False
+
+    def stats(self):
+        """Return cache counters."""
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import threading
+
+# Lower value is more urgent
+PRIORITY_DOOR = 0
+PRIORITY_SLACK = 1
+
+class Dispatcher:
+    def __init__(self, logger, workers=4, max_queue=1000, name="dispatcher"):
+        """
+        Initialize the Dispatcher.
+
+        Outbound work (Slack posts, slash command responses) is queued here
+        so that the MQTT loop thread never blocks on HTTP. Panopticon calls
+        go through the Outbox instead.
+
+        Args:
+            logger: Logger instance (optional)
+            workers: Number of worker threads
+            max_queue: Maximum number of queued tasks. When the queue is full,
+                       a new task evicts the least urgent queued task if it is
+                       more urgent than that task; otherwise the new task is dropped.
+            name: Prefix for worker thread names
+        """
+        self.logger = logger
+        self.workers = workers
+        self.max_queue = max_queue
+        self.name = name
+        self.queue = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = False
+        self.threads = []
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def submit(self, priority, func, *args, on_evict=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) for execution. Never blocks.
+        Returns False if the task was dropped because the queue is full.
+        If the task is later evicted by a more urgent one, on_evict(*args,
+        **kwargs) is called instead, without the dispatcher lock held.
+        """
+        item = (priority, next(self.seq), func, args, kwargs, on_evict)
+        evicted = None
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                # Find the least urgent (and, among equals, newest) queued task
+                worst = max(range(len(self.queue)), key=lambda i: self.queue[i][:2])
+                if self.queue[worst][:2] <= item[:2]:
+                    self.dropped += 1
+                    self.log_info(f"{self.name}: queue full, dropping {func.__name__}")
+                    return False
+                evicted = self.queue[worst]
+                self.queue[worst] = self.queue[-1]
+                self.queue.pop()
+                heapq.heapify(self.queue)
+                self.dropped += 1
+                self.log_info(f"{self.name}: queue full, evicting {evicted[2].__name__}")
+            heapq.heappush(self.queue, item)
+            self.cond.notify()
+        if evicted and evicted[5]:
+            _, _, _, args, kwargs, on_evict = evicted
+            try:
+                on_evict(*args, **kwargs)
+            except Exception as e:
+                self.log_info(f"{self.name}: {on_evict.__name__} exception: {e}")
+        return True
+
+    def _worker_loop(self):
+        """Main loop for a worker thread."""
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                _, _, func, args, kwargs, _ = heapq.heappop(self.queue)
+            try:
+                func(*args, **kwargs)
+                with self.cond:
+                    self.completed += 1
+            except Exception as e:
+                with self.cond:
+                    self.failed += 1
+                self.log_info(f"{self.name}: {func.__name__} exception: {e}")
+
+    def stats(self):
+        """Return queue and task counters."""
+        with self.cond:
+            return {
+                "queued": len(self.queue),
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def start(self):
+        """Start the worker threads."""
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.log_info(f"{self.name} started with {self.workers} workers, queue size {self.max_queue}")
+
+    def stop(self, timeout=5):
+        """Stop the worker threads after the queue has drained."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
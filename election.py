@@ -0,0 +1,77 @@
+import fcntl
+import os
+import threading
+import time
+
+class LeaderElection:
+    def __init__(self, lock_path, on_elected, logger, interval=5):
+        """
+        Initialize the LeaderElection.
+
+        Elects one server process to run the components that must only run
+        once (the MQTT subscriber and what it feeds). The leader holds an
+        exclusive lock on lock_path for as long as it lives; the kernel
+        releases it when the process exits, and another process takes over
+        within interval seconds.
+
+        Args:
+            lock_path: Path of the lock file
+            on_elected: Function called once, in the election thread, when
+                        this process becomes the leader
+            logger: Logger instance (optional)
+            interval: Seconds between attempts to take the lock
+        """
+        self.lock_path = lock_path
+        self.on_elected = on_elected
+        self.logger = logger
+        self.interval = interval
+        self.fd = None
+        self.running = False
+        self.thread = None
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    @property
+    def is_leader(self):
+        return self.fd is not None
+
+    def try_acquire(self):
+        """Take the lock if it is free. Returns True if this process is the leader."""
+        if self.fd is not None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.fd = fd
+        return True
+
+    def _elect_loop(self):
+        """Main loop for the election thread."""
+        while self.running:
+            try:
+                if self.try_acquire():
+                    self.log_info(f"LeaderElection: process {os.getpid()} is the leader")
+                    self.on_elected()
+                    return
+            except Exception as e:
+                self.log_info(f"LeaderElection exception: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start the election thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._elect_loop, name="leader-election", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop trying to become the leader."""
+        self.running = False
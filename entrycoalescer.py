@@ -0,0 +1,60 @@
+import threading
+
+class EntryCoalescer:
+    def __init__(self, window, emit, logger):
+        """
+        Initialize the EntryCoalescer.
+
+        The first entry through a door after an idle period is emitted at once.
+        Further entries within the following window are counted and emitted
+        as one summary when the window ends.
+
+        Args:
+            window: Window length in seconds; 0 emits every entry at once
+            emit: Called as emit(door, count) from the caller's thread for
+                  the first entry and from a timer thread for summaries
+            logger: Logger instance (optional)
+        """
+        self.window = window
+        self.emit = emit
+        self.logger = logger
+        self.lock = threading.Lock()
+        # door -> number of entries since the window started
+        self.pending = {}
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def add(self, door):
+        """Register an entry through a door."""
+        if self.window <= 0:
+            self.emit(door, 1)
+            return
+        with self.lock:
+            if door in self.pending:
+                self.pending[door] += 1
+                return
+            self.pending[door] = 0
+            self._start_timer(door)
+        self.emit(door, 1)
+
+    def _start_timer(self, door):
+        timer = threading.Timer(self.window, self._window_ended, args=(door,))
+        timer.daemon = True
+        timer.start()
+
+    def _window_ended(self, door):
+        with self.lock:
+            count = self.pending[door]
+            if count == 0:
+                # Idle; the next entry is emitted immediately
+                del self.pending[door]
+                return
+            self.pending[door] = 0
+            self._start_timer(door)
+        self.log_info(f"Coalesced {count} entries for {door}")
+        try:
+            self.emit(door, count)
+        except Exception as e:
+            self.log_info(f"EntryCoalescer emit exception: {e}")
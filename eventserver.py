@@ -0,0 +1,287 @@
+import selectors
+import socket
+import threading
+import time
+
+from broadcaster import KEEPALIVE
+
+# Largest request head accepted, and seconds a client has to send it
+MAX_REQUEST_SIZE = 8192
+REQUEST_TIMEOUT = 10
+
+STREAM_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                  b"Content-Type: text/event-stream\r\n"
+                  b"Cache-Control: no-cache\r\n"
+                  # Do not let a reverse proxy buffer the stream
+                  b"X-Accel-Buffering: no\r\n"
+                  b"Access-Control-Allow-Origin: *\r\n"
+                  b"Connection: close\r\n\r\n")
+PREFLIGHT_HEADERS = (b"Access-Control-Allow-Origin: *\r\n"
+                     b"Access-Control-Allow-Methods: GET\r\n"
+                     b"Access-Control-Allow-Headers: Authentication, Last-Event-ID, Cache-Control\r\n"
+                     b"Access-Control-Max-Age: 86400\r\n")
+
+class EventClient:
+    """One connection: its request while it is being read, then its stream."""
+    __slots__ = ('sock', 'inbuf', 'outbuf', 'subscriber', 'private', 'deadline', 'written', 'closing')
+
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.subscriber = None
+        self.private = False
+        self.deadline = now + REQUEST_TIMEOUT
+        # Last time bytes were sent, or the stream started
+        self.written = now
+        # Close once outbuf has been sent
+        self.closing = False
+
+class EventServer:
+    def __init__(self, broadcaster, bind, authorize, initial, logger, timeout=60, max_buffer=65536):
+        """
+        Initialize the EventServer.
+
+        Serves GET /events from an EventBroadcaster on a port of its own,
+        with one thread per server process: sockets are non-blocking and
+        multiplexed with a selector, so an idle subscriber costs a socket
+        and a Subscriber rather than a request thread. Every server process
+        listens on the same port (SO_REUSEPORT), and the kernel spreads the
+        connections between them.
+
+        A client that leaves sent data unread for timeout seconds, or lets
+        more than max_buffer bytes pile up, is disconnected.
+
+        Args:
+            broadcaster: EventBroadcaster of this process
+            bind: (host, port) to listen on
+            authorize: Function taking the request headers (lower-case
+                       names) and returning True if the client may see
+                       private events, None if it may only see public
+                       ones, and False to reject it
+            initial: Function taking that flag and returning the frames a
+                     new (not resuming) client starts with
+            logger: Logger instance (optional)
+            timeout: Seconds a client may leave sent data unread
+            max_buffer: Maximum bytes buffered for a client
+        """
+        self.broadcaster = broadcaster
+        self.bind = bind
+        self.authorize = authorize
+        self.initial = initial
+        self.logger = logger
+        self.timeout = timeout
+        self.max_buffer = max_buffer
+        self.clients = {}
+        self.selector = None
+        self.listener = None
+        self.wakeup = None
+        self.woken = None
+        self.running = False
+        self.thread = None
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _wake(self):
+        """Wake the server thread. Called by the broadcaster with its lock held."""
+        try:
+            self.wakeup.send(b'\0')
+        except BlockingIOError:
+            # Already pending
+            pass
+
+    def _close(self, client):
+        self.selector.unregister(client.sock)
+        del self.clients[client.sock]
+        client.sock.close()
+        if client.subscriber:
+            self.broadcaster.unsubscribe(client.subscriber)
+
+    def _flush(self, client):
+        """Send as much buffered output as the socket takes."""
+        try:
+            while client.outbuf:
+                sent = client.sock.send(client.outbuf)
+                del client.outbuf[:sent]
+                client.written = time.monotonic()
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(client)
+            return
+        if not client.outbuf and client.closing:
+            self._close(client)
+        elif len(client.outbuf) > self.max_buffer:
+            self.log_info("EventServer: dropping client that stopped reading")
+            self._close(client)
+        else:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.outbuf else 0)
+            self.selector.modify(client.sock, events, client)
+
+    def _respond(self, client, status, headers=b""):
+        """Send a response without a body and close the connection."""
+        client.outbuf += b"HTTP/1.1 " + status + b"\r\n" + headers + \
+            b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+        client.closing = True
+        self._flush(client)
+
+    def _start_stream(self, client):
+        """Parse the request head and start the stream, or reject the request."""
+        head = bytes(client.inbuf).split(b"\r\n\r\n", 1)[0].decode('latin-1')
+        lines = head.split("\r\n")
+        request = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        if len(request) != 3:
+            return self._respond(client, b"400 Bad Request")
+        method, target, _ = request
+        if target.split("?", 1)[0] != "/events":
+            return self._respond(client, b"404 Not Found")
+        if method == "OPTIONS":
+            return self._respond(client, b"204 No Content", PREFLIGHT_HEADERS)
+        if method != "GET":
+            return self._respond(client, b"405 Method Not Allowed", b"Allow: GET, OPTIONS\r\n")
+        private = self.authorize(headers)
+        if private is False:
+            return self._respond(client, b"403 Forbidden")
+        try:
+            last_event_id = int(headers['last-event-id'])
+        except (KeyError, ValueError):
+            last_event_id = None
+        client.subscriber = self.broadcaster.subscribe(last_event_id)
+        if client.subscriber is None:
+            return self._respond(client, b"503 Service Unavailable")
+        client.private = bool(private)
+        client.inbuf = None
+        client.outbuf += STREAM_HEADERS + b"retry: 3000\n\n"
+        if last_event_id is None:
+            # New clients start with the current state; resumed ones already have it
+            client.outbuf += b''.join(self.initial(client.private))
+        else:
+            # Events missed while reconnecting
+            client.outbuf += self.broadcaster.read(client.subscriber, client.private) or b''
+        self._flush(client)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # E.g. out of file descriptors; retried on the next event
+                self.log_info(f"EventServer: accept failed: {e}")
+                return
+            sock.setblocking(False)
+            client = EventClient(sock, time.monotonic())
+            self.clients[sock] = client
+            self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            # Disconnected
+            self._close(client)
+        elif client.inbuf is not None and not client.closing:
+            client.inbuf += data
+            if b"\r\n\r\n" in client.inbuf:
+                self._start_stream(client)
+            elif len(client.inbuf) > MAX_REQUEST_SIZE:
+                self._respond(client, b"431 Request Header Fields Too Large")
+
+    def _publish(self):
+        """Queue new events for every stream."""
+        try:
+            while self.woken.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        for client in list(self.clients.values()):
+            if client.subscriber is None or client.closing:
+                continue
+            chunk = self.broadcaster.read(client.subscriber, client.private)
+            if chunk is None:
+                self._close(client)
+            elif chunk:
+                client.outbuf += chunk
+                self._flush(client)
+
+    def _sweep(self, now):
+        """Time out stalled clients and send keep-alives on idle streams."""
+        for client in list(self.clients.values()):
+            if client.subscriber is None or client.closing:
+                if now > client.deadline:
+                    self._close(client)
+            elif client.outbuf:
+                if now - client.written > self.timeout:
+                    self.log_info(f"EventServer: dropping client that stopped reading for {self.timeout}s")
+                    self._close(client)
+            elif now - client.written >= self.broadcaster.heartbeat:
+                client.outbuf += KEEPALIVE
+                self._flush(client)
+
+    def _serve_loop(self):
+        """Main loop for the server thread."""
+        swept = time.monotonic()
+        while self.running:
+            try:
+                for key, mask in self.selector.select(timeout=1):
+                    if key.fileobj is self.listener:
+                        self._accept()
+                    elif key.fileobj is self.woken:
+                        self._publish()
+                    # Skip clients closed earlier in this pass
+                    elif key.fileobj in self.clients:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if mask & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                            self._flush(key.data)
+                now = time.monotonic()
+                if now - swept >= 1:
+                    self._sweep(now)
+                    swept = now
+            except Exception as e:
+                self.log_info(f"EventServer exception: {e}")
+                time.sleep(1)
+        for client in list(self.clients.values()):
+            self._close(client)
+        self.selector.close()
+        self.listener.close()
+
+    def start(self):
+        """Start listening and the server thread."""
+        if self.running:
+            return
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.listener.bind(self.bind)
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.woken, self.wakeup = socket.socketpair()
+        self.woken.setblocking(False)
+        self.wakeup.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.woken, selectors.EVENT_READ)
+        self.broadcaster.add_listener(self._wake)
+        self.running = True
+        self.thread = threading.Thread(target=self._serve_loop, name="event-server", daemon=True)
+        self.thread.start()
+        self.log_info(f"EventServer listening on {self.bind[0]}:{self.bind[1]}")
+
+    def stop(self):
+        """Stop the server thread and disconnect all clients."""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,360 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Bytes per read when the server cannot use sendfile
+READ_BLOCK_SIZE = 65536
+# ESP-IDF images start with a 24 byte image header and an 8 byte segment
+# header, followed by esp_app_desc_t: magic word, secure_version, reserved
+# words and the 32 byte version string
+ESP_APP_DESC_OFFSET = 32
+ESP_APP_DESC_MAGIC = 0xABCD5432
+# Image name taken by the manifest route (/firmware/manifest); an image
+# 'manifest.bin' could never be downloaded, so it is not served or listed
+MANIFEST_NAME = 'manifest'
+# Compressed variants are only kept if they save at least this fraction
+MIN_COMPRESSION_SAVING = 0.05
+# Content-Encoding -> (cache file suffix, compress function)
+ENCODINGS = {
+    'gzip': ('gz', lambda data: gzip.compress(data, 9, mtime=0)),
+    'deflate': ('zz', lambda data: zlib.compress(data, 9)),
+}
+
+def read_version(file):
+    """Return the version string of an ESP-IDF application image, or None."""
+    file.seek(ESP_APP_DESC_OFFSET)
+    desc = file.read(48)
+    file.seek(0)
+    if len(desc) < 48 or struct.unpack_from('<I', desc)[0] != ESP_APP_DESC_MAGIC:
+        return None
+    return desc[16:48].split(b'\0', 1)[0].decode('ascii', errors='replace') or None
+
+class FirmwareFile:
+    """A firmware image as of one (inode, size, mtime)."""
+    __slots__ = ('name', 'path', 'ino', 'size', 'mtime_ns', 'etag', 'version', 'variants')
+
+    def __init__(self, name, path, stat, etag, version):
+        self.name = name
+        self.path = path
+        self.ino = stat.st_ino
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.etag = etag
+        self.version = version
+        # Content-Encoding -> (path, size), smallest first
+        self.variants = {}
+
+    def matches(self, stat):
+        return (self.ino, self.size, self.mtime_ns) == (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class FileRangeBody:
+    def __init__(self, file, offset, length, environ, on_close=None):
+        """
+        WSGI response body sending length bytes of an open file from offset.
+
+        On the werkzeug server the bytes are passed to the client socket with
+        sendfile(2) once the headers have been written; on other servers the
+        file is read in blocks. The file is closed, and on_close called, when
+        the server closes the response.
+
+        Args:
+            file: File opened in binary mode
+            offset: First byte to send
+            length: Number of bytes to send
+            environ: WSGI environment of the request
+            on_close: Function to call when the response is closed (optional)
+        """
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.socket = environ.get('werkzeug.socket')
+        self.on_close = on_close
+
+    def __iter__(self):
+        if self.socket is not None:
+            return self._sendfile()
+        return self._read()
+
+    def _sendfile(self):
+        # An empty write makes the server send the status line and headers
+        yield b''
+        self.socket.sendfile(self.file, self.offset, self.length)
+
+    def _read(self):
+        self.file.seek(self.offset)
+        remaining = self.length
+        while remaining > 0:
+            data = self.file.read(min(READ_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        self.file.close()
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close()
+
+class ClosingFile:
+    """File passed to wsgi.file_wrapper that calls on_close after closing the file."""
+
+    def __init__(self, file, on_close):
+        self.file = file
+        self.on_close = on_close
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close()
+
+def file_body(file, offset, length, environ, on_close=None):
+    """
+    Return a WSGI response body sending length bytes of an open file from
+    offset, with sendfile(2) where the server supports it. The response
+    must have Content-Length set to length.
+    """
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if 'werkzeug.socket' not in environ and file_wrapper is not None:
+        # e.g. gunicorn, which sends the file from its current offset up to Content-Length
+        file.seek(offset)
+        return file_wrapper(ClosingFile(file, on_close), READ_BLOCK_SIZE)
+    return FileRangeBody(file, offset, length, environ, on_close)
+
+class FirmwareStore:
+    def __init__(self, firmware_dir, cache_dir, logger, max_transfers=4, interval=10):
+        """
+        Initialize the FirmwareStore.
+
+        Looks up firmware images '<name>.bin' and keeps the content hash of
+        each, used as its ETag. The hash is only computed again when the
+        file's inode, size or modification time changes. The number of
+        concurrent downloads is capped, so a rollout to every device at
+        once, or a few slow devices, cannot take all server threads.
+
+        A background thread scans the directory for new and changed images,
+        writes gzip and deflate variants of each to cache_dir, and keeps a
+        serialized manifest of all images, so devices can check for new
+        firmware without downloading it. The image name MANIFEST_NAME is
+        reserved for the manifest.
+
+        Args:
+            firmware_dir: Directory holding the firmware images
+            cache_dir: Directory for the compressed variants
+            logger: Logger instance (optional)
+            max_transfers: Maximum number of concurrent downloads
+            interval: Seconds between scans of firmware_dir
+        """
+        self.firmware_dir = firmware_dir
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        # image name -> FirmwareFile
+        self.files = {}
+        self.transfers = threading.BoundedSemaphore(max_transfers)
+        # (manifest JSON bytes, ETag), None until the first scan
+        self.manifest = None
+        # Whether an image with the reserved name has been reported
+        self.reported_reserved = False
+        self.running = False
+        self.thread = None
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _lookup(self, name, file):
+        """Return the FirmwareFile for an open image, hashing it if it has changed."""
+        stat = os.fstat(file.fileno())
+        with self.lock:
+            info = self.files.get(name)
+        if info is None or not info.matches(stat):
+            etag = hashlib.file_digest(file, 'sha256').hexdigest()
+            info = FirmwareFile(name, file.name, stat, etag, read_version(file))
+            with self.lock:
+                self.files[name] = info
+            self.log_info(f"Firmware {name}: {info.size} bytes, version {info.version}, hash {info.etag}")
+        return info
+
+    def open(self, name, encodings=()):
+        """
+        Open a firmware image, or the first of its compressed variants with
+        a Content-Encoding in encodings. Returns (open file, FirmwareFile,
+        encoding or None, size, ETag), or None if there is no such image.
+        """
+        if not name or name.startswith('.') or '/' in name or '\\' in name or name == MANIFEST_NAME:
+            return None
+        path = os.path.join(self.firmware_dir, f"{name}.bin")
+        try:
+            file = open(path, 'rb')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return None
+        try:
+            # Use the open file throughout, so a replaced image is never mixed up
+            info = self._lookup(name, file)
+            for encoding, (variant_path, size) in info.variants.items():
+                if encoding not in encodings:
+                    continue
+                try:
+                    variant = open(variant_path, 'rb')
+                except FileNotFoundError:
+                    continue
+                file.close()
+                return variant, info, encoding, size, f"{info.etag}-{ENCODINGS[encoding][0]}"
+            return file, info, None, info.size, info.etag
+        except Exception:
+            file.close()
+            raise
+
+    def _make_variants(self, info):
+        """Write the compressed variants of an image to the cache directory."""
+        with open(info.path, 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != info.etag:
+            # Changed since it was hashed; picked up by the next scan
+            return
+        variants = []
+        for encoding, (suffix, compress) in ENCODINGS.items():
+            path = os.path.join(self.cache_dir, f"{info.name}-{info.etag}.{suffix}")
+            if not os.path.exists(path):
+                compressed = compress(data)
+                if len(compressed) > len(data) * (1 - MIN_COMPRESSION_SAVING):
+                    continue
+                # Other server processes may be writing the same variant
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp, path)
+            variants.append((os.path.getsize(path), encoding, path))
+        info.variants = { encoding: (path, size) for size, encoding, path in sorted(variants) }
+        if variants:
+            self.log_info(f"Firmware {info.name}: " +
+                          ", ".join(f"{encoding} {size} bytes" for size, encoding, _ in sorted(variants)))
+
+    def _is_stale(self, variant, found):
+        """
+        True if a cached variant '<name>-<hash>.<suffix>' belongs to an image
+        that no longer exists, or to an older version of it.
+        """
+        stem, _, suffix = variant.rpartition('.')
+        name, _, etag = stem.rpartition('-')
+        if not name or suffix not in {known for known, _ in ENCODINGS.values()}:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.firmware_dir, f"{name}.bin"))
+        except FileNotFoundError:
+            return True
+        info = found.get(name)
+        # Only trust the hash if the image has not changed since it was
+        # scanned; another process may already have written its new variants
+        return info is not None and info.matches(stat) and info.etag != etag
+
+    def _remove_stale_variants(self, found):
+        """Remove the variants of images that were replaced or deleted."""
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.tmp') and self._is_stale(entry.name, found):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        # Removed by another process
+                        pass
+
+    def refresh(self):
+        """Scan the firmware directory, update variants and rebuild the manifest if anything changed."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = {}
+        try:
+            entries = list(os.scandir(self.firmware_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith('.bin') or not entry.is_file():
+                continue
+            name = entry.name[:-len('.bin')]
+            if name == MANIFEST_NAME:
+                if not self.reported_reserved:
+                    self.log_info(f"Firmware {entry.name}: name is reserved for the manifest, ignoring it")
+                    self.reported_reserved = True
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    info = self._lookup(name, f)
+                # Written again if another process removed them
+                if not info.variants or \
+                        not all(os.path.exists(path) for path, _ in info.variants.values()):
+                    self._make_variants(info)
+            except OSError as e:
+                self.log_info(f"Firmware {name}: {e}")
+                continue
+            found[name] = info
+        with self.lock:
+            for name in set(self.files) - set(found):
+                del self.files[name]
+        self._remove_stale_variants(found)
+        images = [
+            {
+                'name': name,
+                'size': info.size,
+                'sha256': info.etag,
+                'version': info.version,
+                'encodings': { encoding: size for encoding, (_, size) in info.variants.items() },
+            }
+            for name, info in sorted(found.items())
+        ]
+        body = json.dumps({ 'images': images }, separators=(',', ':')).encode('utf-8')
+        if self.manifest is None or self.manifest[0] != body:
+            self.manifest = (body, hashlib.sha256(body).hexdigest()[:32])
+
+    def get_manifest(self):
+        """Return (manifest JSON bytes, ETag), scanning the directory first if needed."""
+        if self.manifest is None:
+            self.refresh()
+        return self.manifest
+
+    def _refresh_loop(self):
+        """Main loop for the scanner thread."""
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log_info(f"FirmwareStore exception: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start the scanner thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._refresh_loop, name="firmware-scan", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the scanner thread."""
+        self.running = False
+
+    def acquire(self):
+        """Reserve a transfer slot. Returns False if all slots are in use."""
+        return self.transfers.acquire(blocking=False)
+
+    def release(self):
+        self.transfers.release()
@@ -0,0 +1,50 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default (connect, read) timeouts in seconds
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+
+class PooledSession(requests.Session):
+    """requests.Session with a default timeout on every request."""
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+def make_session(pool_size=4, retries=HTTP_RETRIES,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+    """
+    Create a keep-alive session with its own connection pool.
+
+    Args:
+        pool_size: Number of connections kept open per host
+        retries: Number of transport-level retries. Connection errors are
+                 retried for every method, as the request never reached the
+                 server. 502/503/504 from a proxy in front of the API are only
+                 retried for idempotent methods: a 504 may come after the API
+                 has processed a POST.
+        timeout: Default (connect, read) timeout in seconds
+    """
+    retry = Retry(total=retries,
+                  connect=retries,
+                  read=0,
+                  status=retries,
+                  status_forcelist=(502, 503, 504),
+                  # Status retries only for idempotent methods; POSTs get connect retries only
+                  allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                  backoff_factor=0.5,
+                  respect_retry_after_header=False,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = PooledSession(timeout)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
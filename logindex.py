@@ -0,0 +1,254 @@
+import gzip
+import os
+import sqlite3
+import threading
+import time
+
+from acslog import parse_line, format_entry, word_matcher
+
+# Bytes from the start of a file used to recognize it after rotation
+HEAD_SIZE = 64
+
+class AcsLogIndex:
+    def __init__(self, path, query, logger, interval=10):
+        """
+        Initialize the AcsLogIndex.
+
+        Incrementally loads the 'time|device|message' lines written by
+        acsmqttlogger into an SQLite database with an index on
+        (device, time) and a full-text index on the message.
+
+        Files are tracked by inode and first bytes, so the current file keeps
+        its offset when it is rotated. A compressed rotated file is skipped
+        if it was indexed under its uncompressed name; if it was partly
+        indexed as the current file, its first bytes match the tracked file
+        and only the lines after the indexed part are loaded.
+
+        Only one server process runs the indexer thread (start()); the
+        others only query the database. Queries are answered between files
+        while the indexer runs; ready is False until the first pass has
+        completed.
+
+        Args:
+            path: Path of the index database
+            query: AcsLogQuery for the log directory
+            logger: Logger instance (optional)
+            interval: Seconds between index updates in the background
+        """
+        self.path = path
+        self.query = query
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.indexed = False
+        self.running = False
+        self.thread = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                time TEXT NOT NULL,
+                device TEXT NOT NULL,
+                message TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_device_time ON entries (device, time);
+            CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts
+                USING fts5(message, content='entries', content_rowid='id');
+            CREATE TABLE IF NOT EXISTS files (
+                inode INTEGER PRIMARY KEY,
+                head BLOB NOT NULL,
+                offset INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS names (
+                name TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT);
+        """)
+        self.db.commit()
+        # Rotated files that have been indexed completely
+        self.names = set()
+        self.load_names()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def load_names(self):
+        """Load the rotated files indexed so far, possibly by another process."""
+        with self.lock:
+            self.names = set(row[0] for row in self.db.execute("SELECT name FROM names"))
+
+    def _insert(self, lines):
+        rows = []
+        for line in lines:
+            parts = parse_line(line)
+            if parts:
+                rows.append((parts[0], parts[1].lower(), parts[2]))
+        if not rows:
+            return 0
+        cursor = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM entries")
+        first_id = cursor.fetchone()[0] + 1
+        self.db.executemany("INSERT INTO entries (time, device, message) VALUES (?, ?, ?)", rows)
+        self.db.execute("INSERT INTO entries_fts (rowid, message) SELECT id, message FROM entries WHERE id >= ?",
+                        (first_id,))
+        return len(rows)
+
+    def _index_plain(self, path):
+        """Index new complete lines of an uncompressed file."""
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            head = f.read(HEAD_SIZE)
+            row = self.db.execute("SELECT head, offset FROM files WHERE inode = ?", (stat.st_ino,)).fetchone()
+            offset = 0
+            if row is not None and head.startswith(row[0]) and stat.st_size >= row[1]:
+                offset = row[1]
+            if stat.st_size == offset:
+                return 0
+            f.seek(offset)
+            data = f.read()
+        # Only index complete lines; the rest is picked up next time
+        end = data.rfind(b'\n') + 1
+        count = self._insert(data[:end].split(b'\n')[:-1])
+        self.db.execute("INSERT OR REPLACE INTO files (inode, head, offset) VALUES (?, ?, ?)",
+                        (stat.st_ino, head, offset + end))
+        return count
+
+    def _index_compressed(self, path):
+        """Index a compressed rotated file, after the part indexed before it was rotated."""
+        with gzip.open(path, 'rb') as f:
+            head = f.read(HEAD_SIZE)
+            # The tracked file this was compressed from; it was tracked with
+            # fewer first bytes if it was still short
+            row = self.db.execute("""SELECT inode, offset FROM files
+                                     WHERE offset > 0 AND head = substr(?, 1, length(head))
+                                     ORDER BY length(head) DESC LIMIT 1""", (head,)).fetchone()
+            offset = 0
+            if row is not None:
+                offset = row[1]
+                # The inode is gone, and may be reused
+                self.db.execute("DELETE FROM files WHERE inode = ?", (row[0],))
+            f.seek(offset)
+            return self._insert(line for line in f)
+
+    def update(self):
+        """Index everything written since the last update. Returns the number of new lines."""
+        count = 0
+        for stamp, path in self.query.history_files():
+            name = os.path.basename(path)
+            if name.endswith('.gz'):
+                name = name[:-len('.gz')]
+            if name in self.names:
+                continue
+            # One file at a time, so queries are not held up for a whole pass
+            with self.lock:
+                if stamp is not None and \
+                        self.db.execute("SELECT 1 FROM names WHERE name = ?", (name,)).fetchone():
+                    # Indexed by another process
+                    self.names.add(name)
+                    continue
+                try:
+                    if path.endswith('.gz'):
+                        count += self._index_compressed(path)
+                    else:
+                        count += self._index_plain(path)
+                    if stamp is not None:
+                        # Rotated files no longer change
+                        self.db.execute("INSERT OR IGNORE INTO names (name) VALUES (?)", (name,))
+                    self.db.commit()
+                    if stamp is not None:
+                        self.names.add(name)
+                except Exception as e:
+                    self.db.rollback()
+                    self.log_info(f"AcsLogIndex: error indexing {path}: {e}")
+        if not self.indexed:
+            with self.lock:
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed', ?)",
+                                (time.strftime('%Y-%m-%d %H:%M:%S'),))
+                self.db.commit()
+            self.indexed = True
+        return count
+
+    @property
+    def ready(self):
+        """True once all log files have been indexed, by this or another process."""
+        if not self.indexed and not self.running:
+            # Indexed by the process running the indexer; never held up by indexing here
+            with self.lock:
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'indexed'").fetchone()
+            self.indexed = row is not None
+        return self.indexed
+
+    def last_entries(self, device, count):
+        """Return the last count 'time message' lines for a device, oldest first."""
+        with self.lock:
+            rows = self.db.execute("""SELECT time, device, message FROM entries WHERE device = ?
+                                      ORDER BY time DESC, id DESC LIMIT ?""",
+                                   (device.lower(), count)).fetchall()
+        return [format_entry(row) for row in reversed(rows)]
+
+    def search(self, device=None, start=None, end=None, text=None, offset=0, limit=25):
+        """
+        Return (time, device, message) rows, oldest first, matching a device,
+        a time range (inclusive time prefixes) and words in the message.
+        """
+        sql = "SELECT entries.time, entries.device, entries.message FROM entries"
+        where = []
+        params = []
+        if text and not (device or start or end):
+            # Match each word as a quoted prefix token
+            words = ' '.join('"%s"*' % w.replace('"', '""') for w in text.split())
+            sql += " JOIN entries_fts ON entries_fts.rowid = entries.id"
+            where.append("entries_fts MATCH ?")
+            params.append(words)
+        elif text:
+            # The (device, time) index is more selective; match the words the
+            # way the full-text index would
+            where.append("message_matches(entries.message)")
+        if device:
+            where.append("entries.device = ?")
+            params.append(device.lower())
+        if start:
+            where.append("entries.time >= ?")
+            params.append(start)
+        if end:
+            # Inclusive prefix: everything up to the end of the prefix
+            where.append("entries.time < ?")
+            params.append(end + '\uffff')
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY entries.time, entries.id LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self.lock:
+            if text:
+                self.db.create_function('message_matches', 1, word_matcher(text), deterministic=True)
+            return self.db.execute(sql, params).fetchall()
+
+    def _update_loop(self):
+        """Main loop for the indexer thread."""
+        while self.running:
+            start = time.monotonic()
+            try:
+                count = self.update()
+                if count:
+                    self.log_info(f"AcsLogIndex: indexed {count} lines in {time.monotonic() - start:.1f}s")
+            except Exception as e:
+                self.log_info(f"AcsLogIndex exception: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start the indexer thread."""
+        if self.running:
+            return
+        # Another process may have indexed files since this one started
+        self.load_names()
+        self.running = True
+        self.thread = threading.Thread(target=self._update_loop, name="acslog-index", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the indexer thread."""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -4,7 +4,6 @@ import datetime
 import hashlib
 import json
 import os
-import requests
 import ssl
 import struct
 import sys
@@ -12,6 +11,15 @@ import time
 
 import paho.mqtt.client as paho
 
+from dedupe import DedupeCache
+from dispatcher import Dispatcher, PRIORITY_DOOR, PRIORITY_SLACK
+from entrycoalescer import EntryCoalescer
+from outbox import Outbox
+from httpsession import make_session
+from publisher import MqttPublisher
+from slackdelivery import SlackDelivery
+from statslogger import StatsLogger
+
 STATUS_TOPIC = "hal9k/acs/status"
 BACKEND_TOPIC = "hal9k/acs/backend"
 
@@ -29,6 +37,36 @@ MQTT_PASSWORD = os.environ['MQTT_PASSWORD']
 ACS_DOOR_TOKEN = os.environ["ACS_DOOR_TOKEN"]
 SLACK_WRITE_TOKEN = os.environ['SLACK_WRITE_TOKEN']
 
+# Slack chat.postMessage pacing per channel
+SLACK_RATE = float(os.environ.get('SLACK_RATE', 1.0))
+SLACK_BURST = int(os.environ.get('SLACK_BURST', 1))
+
+# Seconds over which "Granted entry" notifications per door are merged (0 to disable)
+ENTRY_COALESCE_WINDOW = int(os.environ.get('ENTRY_COALESCE_WINDOW', 30))
+
+# Spool for Panopticon API calls, on the persistent volume
+OUTBOX_PATH = os.environ.get('OUTBOX_PATH', '/opt/service/persistent/spool/outbox.db')
+PANOPTICON_URL = 'https://panopticon.hal9k.dk/api/v1'
+# Access logs are posted in batches of up to LOG_BATCH_SIZE entries,
+# held back for at most LOG_BATCH_MAX_AGE seconds
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 50))
+LOG_BATCH_MAX_AGE = float(os.environ.get('LOG_BATCH_MAX_AGE', 5))
+LOG_BULK_URLS = {
+    f"{PANOPTICON_URL}/logs": f"{PANOPTICON_URL}/logs/bulk",
+    f"{PANOPTICON_URL}/logs/delegate": f"{PANOPTICON_URL}/logs/delegate/bulk",
+}
+
+# Outbound HTTP worker pool
+DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', 4))
+DISPATCH_QUEUE_SIZE = int(os.environ.get('DISPATCH_QUEUE_SIZE', 1000))
+
+# Seconds between log lines with the delivery and dedupe counters
+STATS_LOG_INTERVAL = int(os.environ.get('STATS_LOG_INTERVAL', 300))
+
+# Backend requests are accepted with stamps up to 30 s in the past or the
+# future, so a redelivery can pass validation for up to 60 s
+BACKEND_STAMP_WINDOW = 30
+
 def verify_hash_with_timestamp(message: str, digest: bytes, timestamp: int) -> bool:
     hasher = hashlib.sha256()
     hasher.update(MQTT_KEY)
@@ -38,67 +76,26 @@ def verify_hash_with_timestamp(message: str, digest: bytes, timestamp: int) -> b
     return hasher.digest() == digest
 
 
-class AcsMqtt(paho.Client):
+class MqttClient(paho.Client):
+    """
+    Connection to the broker for publishing. Every server process has one;
+    only the process running AcsMqtt subscribes.
+    """
     def __init__(self, logger, userdata):
         super().__init__(client_id="", userdata=userdata, protocol=paho.MQTTv5)
         self.logger = logger
-        self.log_info("AcsMqtt init")
         self.app = userdata
+        self.username_pw_set(MQTT_USER, MQTT_PASSWORD)
+        # Shared publisher for outgoing messages on this connection
+        self.publisher = MqttPublisher(self, logger)
 
     def log_info(self, msg):
         if self.logger:
             self.logger.info(msg)
 
-    def slack_write(self, msg, channel='jeg-står-herude-og-banker-på'):
-        if "|" in msg:
-            parts = msg.split("|")
-            msg = parts[0]
-            channel = parts[1]
-            if len(parts) > 2:
-                c_emoji = parts[2]
-        self.log_info(f"slack_write: #{channel}: {msg}")
-        try:
-            body = { 'channel': channel, 'icon_emoji': ':panopticon:', 'parse': 'full', 'text': msg }
-            headers = {
-                    'content_type': 'application/json',
-                    'Authorization': 'Bearer %s' % SLACK_WRITE_TOKEN
-                }
-            r = requests.post(url = 'https://slack.com/api/chat.postMessage', data = body, headers = headers)
-            self.log_info(f"slack_write: {r}")
-        except Exception as e:
-            self.log_info(f"Slack exception: {e}")
-
-    def log_backend(self, user_id, machine, message):
-        if machine is not None:
-            try:
-                body = { "api_token": ACS_DOOR_TOKEN, "log": { "message": message, "machine": machine } }
-                if user_id is not None:
-                    body["log"]["user_id"] = user_id
-                r = requests.post(url = 'https://panopticon.hal9k.dk/api/v1/logs/delegate', json = body)
-                self.log_info(f"log_backend delegate: {r}")
-            except Exception as e:
-                self.log_info(f"log_backend delegate exception: {e}")
-        else:
-            try:
-                body = { "api_token": ACS_DOOR_TOKEN, "log": { "message": message } }
-                if user_id is not None:
-                    body["log"]["user_id"] = user_id
-                r = requests.post(url = 'https://panopticon.hal9k.dk/api/v1/logs', json = body)
-                self.log_info(f"log_backend: {r}")
-            except Exception as e:
-                self.log_info(f"log_backend exception: {e}")
-
-    def log_unknown_card(self, card_id):
-        try:
-            body = { "api_token": ACS_DOOR_TOKEN, "card_id": card_id }
-            r = requests.post(url = 'https://panopticon.hal9k.dk/api/v1/unknown_cards', json = body)
-        except Exception as e:
-            self.log_info(f"log_unknown_card exception: {e}")
-
     def on_connect(self, client, userdata, flags, rc, props=None):
         self.log_info("MQTT connected")
-        client.subscribe(f"{STATUS_TOPIC}/#", qos=1)
-        client.subscribe(f"{BACKEND_TOPIC}/#", qos=1)
+        self.publisher.flush()
 
     def on_disconnect(self, client, userdata, flags, rc, props=None):
         self.log_info("MQTT disconnected")
@@ -124,6 +121,71 @@ class AcsMqtt(paho.Client):
             time.sleep(backoff)
             backoff = min(30, backoff * 2)
 
+class AcsMqtt(MqttClient):
+    """Subscriber for ACS status and backend requests. Runs in one server process."""
+    def __init__(self, logger, userdata):
+        super().__init__(logger, userdata)
+        self.log_info("AcsMqtt init")
+        self.dispatcher = Dispatcher(logger, DISPATCH_WORKERS, DISPATCH_QUEUE_SIZE)
+        self.dispatcher.start()
+        # Separate keep-alive pools for each API
+        self.slack_http = make_session(DISPATCH_WORKERS)
+        self.panopticon_http = make_session(DISPATCH_WORKERS)
+        self.slack = SlackDelivery(self.slack_http, SLACK_WRITE_TOKEN, self.dispatcher, logger,
+                                   rate=SLACK_RATE, burst=SLACK_BURST)
+        self.slack.start()
+        self.entries = EntryCoalescer(ENTRY_COALESCE_WINDOW, self.slack_entries, logger)
+        self.outbox = Outbox(OUTBOX_PATH, self.panopticon_http, ACS_DOOR_TOKEN, logger,
+                             bulk_urls=LOG_BULK_URLS, batch_size=LOG_BATCH_SIZE, max_age=LOG_BATCH_MAX_AGE)
+        self.outbox.start()
+        # Signed (stamp, hash) pairs of recently handled backend requests
+        self.seen_requests = DedupeCache(2 * BACKEND_STAMP_WINDOW)
+        self.stats = StatsLogger({ 'dispatcher': self.dispatcher.stats, 'slack': self.slack.stats,
+                                   'dedupe': self.seen_requests.stats },
+                                 STATS_LOG_INTERVAL, logger)
+        self.stats.start()
+
+    def slack_write(self, msg, channel='jeg-står-herude-og-banker-på', priority=PRIORITY_SLACK):
+        if "|" in msg:
+            parts = msg.split("|")
+            msg = parts[0]
+            channel = parts[1]
+            if len(parts) > 2:
+                c_emoji = parts[2]
+        self.log_info(f"slack_write: #{channel}: {msg}")
+        self.slack.send(channel, msg, priority)
+
+    def slack_entries(self, device, count):
+        desc = FRONTEND_DESC_MAP.get(device, "the unknowns:interrobang:")
+        if count == 1:
+            self.slack_write(f":unlock: A hacker just entered {desc}", priority=PRIORITY_DOOR)
+        else:
+            self.slack_write(f":unlock: {count} hackers entered {desc} in the last {ENTRY_COALESCE_WINDOW} s",
+                             priority=PRIORITY_DOOR)
+
+    def log_backend(self, user_id, machine, message):
+        try:
+            body = { "log": { "message": message } }
+            if machine is not None:
+                body["log"]["machine"] = machine
+            if user_id is not None:
+                body["log"]["user_id"] = user_id
+            url = f"{PANOPTICON_URL}/logs/delegate" if machine is not None else f"{PANOPTICON_URL}/logs"
+            self.outbox.append(url, body)
+        except Exception as e:
+            self.log_info(f"log_backend exception: {e}")
+
+    def log_unknown_card(self, card_id):
+        try:
+            self.outbox.append(f"{PANOPTICON_URL}/unknown_cards", { "card_id": card_id })
+        except Exception as e:
+            self.log_info(f"log_unknown_card exception: {e}")
+
+    def on_connect(self, client, userdata, flags, rc, props=None):
+        client.subscribe(f"{STATUS_TOPIC}/#", qos=1)
+        client.subscribe(f"{BACKEND_TOPIC}/#", qos=1)
+        super().on_connect(client, userdata, flags, rc, props)
+
     def is_backend_request_valid(self, data):
         """
         Validate backend request using MQTT_KEY
@@ -146,7 +208,7 @@ class AcsMqtt(paho.Client):
         # Verify timestamp is not too old (30 seconds)
         try:
             current_time = int(datetime.datetime.now().timestamp())
-            if abs(current_time - stamp) > 30:
+            if abs(current_time - stamp) > BACKEND_STAMP_WINDOW:
                 self.log_info('Backend request timestamp too old: %d' % stamp)
                 return False
         except (ValueError, TypeError) as e:
@@ -155,6 +217,16 @@ class AcsMqtt(paho.Client):
 
         return verify_hash_with_timestamp(text, bytes.fromhex(hash), stamp)
 
+    def is_duplicate(self, data):
+        """
+        Check whether a valid backend request has already been handled
+        (e.g. a QoS 1 redelivery after reconnect)
+        """
+        if self.seen_requests.seen((int(data["stamp"]), data["hash"])):
+            self.log_info(f"Duplicate backend request: {data}")
+            return True
+        return False
+
     def on_message(self, client, userdata, message):
         try:
             device = None
@@ -177,12 +249,15 @@ class AcsMqtt(paho.Client):
             if message.topic.startswith(STATUS_TOPIC):
                 if device == "space":
                     is_space_open = data["status"] == "open"
-                    if is_space_open != self.app.is_space_open:
-                        self.app.is_space_open = is_space_open
-                        self.app.space_open_lastchange = int(time.time())
-                        self.log_info(f"Space open: {self.app.is_space_open}")
+                    if self.app.spaceapi.set_open(is_space_open):
+                        self.app.event_sink.publish("space", self.app.spaceapi.space())
+                        self.log_info(f"Space open: {is_space_open}")
                     return
-                userdata.status[device] = data
+                if "ack" in data:
+                    # An action sent by the gateway has been carried out
+                    self.app.acks.ack(device, data["ack"])
+                if userdata.status.update(device, data) is not None:
+                    self.app.event_sink.publish("status", { "device": device, "status": data })
                 self.log_info(f"Updated MQTT status for {device}")
             elif message.topic.startswith(BACKEND_TOPIC):
                 # "hal9k/acs/backend/log <json>"
@@ -199,14 +274,17 @@ class AcsMqtt(paho.Client):
                         if not self.is_backend_request_valid(data):
                             self.log_info(f"Invalid backend/log request: {data}")
                             return
+                        if self.is_duplicate(data):
+                            return
                         self.log_info(f"backend log: request is valid")
                         device = data["identifier"]
+                        # Doors count granted entries, other devices every event
+                        if self.app.usage is not None:
+                            if device not in FRONTEND_DESC_MAP or "Granted entry" in data["text"]:
+                                self.app.usage.record(device)
                         if "Granted entry" in data["text"]:
-                            if device in FRONTEND_DESC_MAP:
-                                self.slack_write(f":unlock: A hacker just entered {FRONTEND_DESC_MAP[device]}")
-                            else:
-                                self.slack_write(f":unlock: A hacker just entered the unknowns:interrobang:")
-                        self.log_info(f"backend log: wrote to Slack")
+                            self.entries.add(device)
+                        self.log_info(f"backend log: queued for Slack")
                         # Log to backend
                         if device in FRONTEND_DESC_MAP:
                             device = None
@@ -218,6 +296,8 @@ class AcsMqtt(paho.Client):
                     if not self.is_backend_request_valid(data):
                         self.log_info(f"Invalid backend/unknown_card request: {data}")
                         return
+                    if self.is_duplicate(data):
+                        return
                     # Log to backend
                     self.log_unknown_card(data["text"])
                 elif action == "slack":
@@ -225,6 +305,8 @@ class AcsMqtt(paho.Client):
                     if not self.is_backend_request_valid(data):
                         self.log_info(f"Invalid backend/slack request: {data}")
                         return
+                    if self.is_duplicate(data):
+                        return
                     msg = data['text']
                     if msg.startswith(":"):
                         # Add identifier after emoji
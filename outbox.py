@@ -0,0 +1,267 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class Outbox:
+    def __init__(self, path, session, token, logger, bulk_urls=None,
+                 batch_size=50, max_age=5, max_backoff=300, compact_interval=3600):
+        """
+        Initialize the Outbox.
+
+        Backend API calls are appended to an SQLite spool (WAL mode) and
+        delivered by a background drainer. Entries are only removed after
+        the server has accepted them, so delivery is at-least-once and
+        survives restarts.
+
+        Entries for URLs in bulk_urls are held until batch_size entries are
+        pending or the oldest is max_age seconds old, and then posted
+        together as { "api_token": ..., "batch": [ body, ... ] }. If the
+        server rejects a batch, that URL falls back to single posts.
+
+        Each URL is drained on its own, with its own backoff, so an
+        endpoint that is down does not hold up the others. Transient
+        failures (connection errors, timeouts, 408, 429 and 5xx) are
+        retried for as long as it takes, so entries outlive an outage of
+        any length. An entry the server rejects (other 4xx) is moved to the
+        outbox_dead table, where it is kept for inspection.
+
+        Args:
+            path: Path of the spool database
+            session: requests session used for delivery
+            token: API token added to each body when it is sent
+            logger: Logger instance (optional)
+            bulk_urls: Maps an endpoint URL to the URL accepting batches for it
+            batch_size: Maximum number of entries replayed per batch
+            max_age: Maximum seconds a batchable entry is held back
+            max_backoff: Maximum delay in seconds between failed attempts
+            compact_interval: Minimum seconds between spool compactions
+        """
+        self.path = path
+        self.session = session
+        self.token = token
+        self.logger = logger
+        self.bulk_urls = dict(bulk_urls or {})
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_backoff = max_backoff
+        self.compact_interval = compact_interval
+        self.last_compact = time.monotonic()
+        # URL -> (monotonic time of the next attempt, current backoff)
+        self.retries = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               url TEXT NOT NULL,
+                               body TEXT NOT NULL,
+                               created REAL NOT NULL,
+                               attempts INTEGER NOT NULL DEFAULT 0)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_url ON outbox (url, id)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbox_dead (
+                               id INTEGER PRIMARY KEY,
+                               url TEXT NOT NULL,
+                               body TEXT NOT NULL,
+                               created REAL NOT NULL,
+                               attempts INTEGER NOT NULL,
+                               failed REAL NOT NULL)""")
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def append(self, url, body):
+        """Spool a JSON body for POSTing to url."""
+        with self.lock:
+            self.db.execute("INSERT INTO outbox (url, body, created) VALUES (?, ?, ?)",
+                            (url, json.dumps(body), time.time()))
+        self.wakeup.set()
+
+    def pending(self):
+        """Return the number of undelivered entries."""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead(self):
+        """Return the number of entries given up on."""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+
+    def _next_batch(self, url):
+        with self.lock:
+            return self.db.execute("SELECT id, body FROM outbox WHERE url = ? ORDER BY id LIMIT ?",
+                                   (url, self.batch_size)).fetchall()
+
+    def _delete(self, ids):
+        with self.lock:
+            self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def _failed(self, ids):
+        """Count a failed delivery of entries; they are retried later."""
+        marks = ','.join('?' * len(ids))
+        with self.lock:
+            self.db.execute(f"UPDATE outbox SET attempts = attempts + 1 WHERE id IN ({marks})", ids)
+
+    def _reject(self, url, entry_id, body):
+        """Move an entry the server rejected to the dead letters."""
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.execute("""INSERT INTO outbox_dead (id, url, body, created, attempts, failed)
+                                   SELECT id, url, body, created, attempts + 1, ? FROM outbox WHERE id = ?""",
+                                (time.time(), entry_id))
+                self.db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        self.log_info(f"outbox: {url} rejected entry {entry_id}, moved to dead letters: {body}")
+
+    def _deliver(self, url, body):
+        """
+        POST one entry. Returns True if delivered, False if it should be
+        retried later, and None if the server rejected it.
+        """
+        body = json.loads(body)
+        try:
+            r = self.session.post(url = url, json = dict(body, api_token = self.token))
+        except Exception as e:
+            self.log_info(f"outbox: {url} exception: {e}")
+            return False
+        self.log_info(f"outbox: {url}: {r}")
+        if r.ok:
+            return True
+        if r.status_code in (408, 429) or r.status_code >= 500:
+            return False
+        return None
+
+    def _deliver_batch(self, url, bodies):
+        """
+        POST a batch of entries. Returns True if delivered, False if it
+        should be retried later, and None if the server does not accept it.
+        """
+        bulk_url = self.bulk_urls[url]
+        try:
+            r = self.session.post(url = bulk_url,
+                                  json = { "api_token": self.token, "batch": [json.loads(b) for b in bodies] })
+        except Exception as e:
+            self.log_info(f"outbox: {bulk_url} exception: {e}")
+            return False
+        self.log_info(f"outbox: {bulk_url} ({len(bodies)} entries): {r}")
+        if r.ok:
+            return True
+        if r.status_code in (408, 429) or r.status_code >= 500:
+            return False
+        return None
+
+    def _drain_url(self, url):
+        """
+        Replay spooled entries for one URL in order until none are left or a
+        delivery fails. Returns True if all entries were delivered or
+        rejected. Failed entries have their attempts counted.
+        """
+        while True:
+            batch = self._next_batch(url)
+            if not batch:
+                return True
+            if url in self.bulk_urls and len(batch) > 1:
+                delivered = self._deliver_batch(url, [body for _, body in batch])
+                if delivered:
+                    self._delete([entry_id for entry_id, _ in batch])
+                    continue
+                if delivered is False:
+                    self._failed([entry_id for entry_id, _ in batch])
+                    return False
+                self.log_info(f"outbox: {self.bulk_urls[url]} rejected batch, using single posts for {url}")
+                del self.bulk_urls[url]
+            done = []
+            failed = False
+            for entry_id, body in batch:
+                delivered = self._deliver(url, body)
+                if delivered is None:
+                    self._reject(url, entry_id, body)
+                    continue
+                if not delivered:
+                    failed = True
+                    break
+                done.append(entry_id)
+            if done:
+                self._delete(done)
+            if failed:
+                self._failed([entry_id])
+                return False
+
+    def drain(self):
+        """
+        Deliver all entries that are due, each URL on its own. Returns (ok,
+        wait) where ok is False if a delivery failed, and wait is the number
+        of seconds until held-back or failed entries become due (None if
+        there are none).
+        """
+        with self.lock:
+            groups = self.db.execute("SELECT url, COUNT(*), MIN(created) FROM outbox GROUP BY url").fetchall()
+        now = time.time()
+        ok = True
+        wait = None
+        for url, count, oldest in groups:
+            retry_at, backoff = self.retries.get(url, (0, None))
+            if retry_at > time.monotonic():
+                due = retry_at - time.monotonic()
+            elif url in self.bulk_urls and count < self.batch_size and oldest + self.max_age > now:
+                due = oldest + self.max_age - now
+            elif self._drain_url(url):
+                self.retries.pop(url, None)
+                continue
+            else:
+                ok = False
+                due = 1 if backoff is None else min(self.max_backoff, backoff * 2)
+                self.retries[url] = (time.monotonic() + due, due)
+                self.log_info(f"outbox: delivery to {url} failed, retrying in {due}s")
+            wait = due if wait is None else min(wait, due)
+        return ok, wait
+
+    def compact(self):
+        """Checkpoint the WAL into the database and reclaim free space."""
+        with self.lock:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.execute("VACUUM")
+        self.last_compact = time.monotonic()
+        self.log_info("outbox: compacted spool")
+
+    def _drain_loop(self):
+        """Main loop for the drainer thread."""
+        while self.running:
+            self.wakeup.clear()
+            try:
+                ok, wait = self.drain()
+                if not ok:
+                    self.log_info(f"outbox: {self.pending()} pending")
+                elif wait is None and time.monotonic() - self.last_compact > self.compact_interval:
+                    self.compact()
+                self.wakeup.wait(self.compact_interval if wait is None else wait)
+            except Exception as e:
+                self.log_info(f"outbox: drainer exception: {e}")
+                time.sleep(1)
+
+    def start(self):
+        """Start the drainer thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._drain_loop, name="outbox", daemon=True)
+        self.thread.start()
+        self.log_info(f"Outbox started, {self.pending()} entries pending and {self.dead()} dead in {self.path}")
+
+    def stop(self):
+        """Stop the drainer thread."""
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,96 @@
+import collections
+import threading
+import time
+
+class PublishFuture:
+    def __init__(self, topic):
+        self.topic = topic
+        self.info = None
+        self.error = None
+        self.sent = threading.Event()
+
+    def _set_info(self, info):
+        self.info = info
+        self.sent.set()
+
+    def _set_error(self, error):
+        self.error = error
+        self.sent.set()
+
+    def done(self):
+        """Return True if the broker has acknowledged the message."""
+        return self.sent.is_set() and self.error is None and self.info.is_published()
+
+    def result(self, timeout=None):
+        """
+        Wait until the broker has acknowledged the message.
+
+        Raises TimeoutError if this does not happen within timeout seconds,
+        and RuntimeError if the message could not be published.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self.sent.wait(timeout):
+            raise TimeoutError(f"Publish to {self.topic} still buffered")
+        if self.error is not None:
+            raise RuntimeError(f"Publish to {self.topic} failed: {self.error}")
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        self.info.wait_for_publish(remaining)
+        if not self.info.is_published():
+            raise TimeoutError(f"Publish to {self.topic} not acknowledged")
+        return True
+
+class MqttPublisher:
+    def __init__(self, client, logger, max_buffer=100):
+        """
+        Initialize the MqttPublisher.
+
+        Publishes through an existing, long-lived MQTT client connection.
+        While the client is disconnected, messages are buffered and sent
+        when the connection is re-established.
+
+        Args:
+            client: Connected paho Client
+            logger: Logger instance (optional)
+            max_buffer: Maximum number of buffered messages; the oldest
+                        message is discarded when the buffer is full
+        """
+        self.client = client
+        self.logger = logger
+        self.buffer = collections.deque()
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        """Publish a message. Never blocks; returns a PublishFuture."""
+        future = PublishFuture(topic)
+        with self.lock:
+            if not self.client.is_connected():
+                if len(self.buffer) >= self.max_buffer:
+                    _, _, _, _, dropped = self.buffer.popleft()
+                    dropped._set_error("publish buffer full")
+                    self.log_info(f"Publish buffer full, dropping message to {dropped.topic}")
+                self.buffer.append((topic, payload, qos, retain, future))
+                self.log_info(f"MQTT not connected, buffering message to {topic}")
+                return future
+        self._send(topic, payload, qos, retain, future)
+        return future
+
+    def _send(self, topic, payload, qos, retain, future):
+        try:
+            future._set_info(self.client.publish(topic, payload, qos=qos, retain=retain))
+        except Exception as e:
+            future._set_error(e)
+
+    def flush(self):
+        """Send buffered messages. Called when the connection is (re)established."""
+        with self.lock:
+            pending = list(self.buffer)
+            self.buffer.clear()
+        if pending:
+            self.log_info(f"Sending {len(pending)} buffered MQTT messages")
+        for message in pending:
+            self._send(*message)
@@ -1,53 +1,111 @@
-from flask import Flask, request, abort, jsonify, send_file
+from flask import Flask, Response, request, abort, jsonify
 from flask_cors import CORS, cross_origin
 from werkzeug.serving import WSGIRequestHandler
 
 import certifi
 import datetime
-import glob
 import hashlib
 import hmac
+import itertools
 import json
 import logging
 from logging import handlers
 import os
-import pytz
 import ssl
 import struct
 import sys
 import time
-import paho.mqtt.publish as publish
 from paho import mqtt
 
-from mqtt import AcsMqtt
+from acktracker import AckTracker, SharedAckTracker
+from acslog import AcsLogFollower, AcsLogQuery
+from broadcaster import EventBroadcaster, EventRelay
+from camactions import CameraActionQueue, SharedCameraActionQueue
+from camctl import CamctlActions, SharedCamctlActions
+from dispatcher import Dispatcher
+from eventserver import EventServer
+from election import LeaderElection
+from firmware import FirmwareStore, file_body
+from httpsession import make_session
+from logindex import AcsLogIndex
+from mqtt import AcsMqtt, MqttClient
+from usagestats import UsageStats
+from sharedstate import SharedState
+from slackresponder import SlackResponder
+from spaceapi import SpaceApiDocument
+from statusstore import StatusStore
 from syncwatcher import SyncWatcher
+from wsgiserver import WsgiServer
 
 # Contains log files written by acsmqttlogger
 LOG_DIR='/opt/service/logs'
 # Mounted at /srv/acsgw/firmware
 FIRMWARE_DIR='/opt/service/persistent/firmware'
+# Compressed variants of the firmware images
+FIRMWARE_CACHE_DIR='/opt/service/persistent/firmware-cache'
 ACS_SYNC_STATUS_FILE="/opt/service/monitoring/acs-sync-status"
+# SQLite index of the ACS logs
+LOG_INDEX_PATH='/opt/service/persistent/acslog-index.db'
+# Per-device usage counters
+USAGE_STATS_FILE='/opt/service/persistent/usage-stats.json'
+# State shared by all server processes
+STATE_PATH='/opt/service/persistent/state.db'
+# Held by the process running the MQTT subscriber
+LEADER_LOCK_PATH='/opt/service/persistent/leader.lock'
+# Number of recent log lines kept in memory per device for /lastlog
+LASTLOG_BUFFER_LINES = 100
+# /logsearch results per reply, and maximum characters shown per line
+LOGSEARCH_PAGE_LINES = 25
+LOGSEARCH_MAX_LINE = 100
 
 DEVICE_ACTIONS = ['lock', 'unlock', 'reboot', 'setdesc', 'setacstoken', 'dummy']
 GLOBAL_ACTIONS = ['open', 'close', 'dummy']
+# Device actions that may be sent to a group of devices
+GROUP_ACTIONS = ['lock', 'unlock', 'reboot', 'dummy']
+# Device groups for /acsaction, e.g. {"barn": ["barndoor", "barngate"]}. The
+# group 'all' holds every ACS frontend that has reported status, unless defined here.
+DEVICE_GROUPS = json.loads(os.environ.get('ACS_DEVICE_GROUPS', '{}'))
 CAMCTL_ACTIONS = ['on', 'off', 'reboot']
 
+# Background workers and queue size for slash commands answered through response_url
+SLASH_WORKERS = int(os.environ.get('SLASH_WORKERS', 8))
+SLASH_QUEUE_SIZE = int(os.environ.get('SLASH_QUEUE_SIZE', 100))
+
+# Seconds clients may cache /spaceapi
+SPACEAPI_MAX_AGE = 10
+# Maximum seconds a GET /camctl?wait=N or /camaction/<instance>?wait=N long-poll blocks
+CAMCTL_MAX_WAIT = 50
+# Maximum concurrent firmware downloads per server process; more get 503 and retry later
+FIRMWARE_MAX_TRANSFERS = 4
+FIRMWARE_RETRY_AFTER = 10
+# Seconds a socket read or write may block before the client is disconnected:
+# the kernel socket timeouts under gunicorn, the socket timeout of the
+# development server, and the send stall limit of the EventServer. Longer
+# than the /events keep-alive interval.
+CLIENT_TIMEOUT = 60
+# Server processes and request threads per process. WORKERS=0 runs the
+# development server in a single process.
+WORKERS = int(os.environ.get('WORKERS', 0))
+THREADS = int(os.environ.get('THREADS', 32))
+# With WORKERS > 0, /events is served on this port by an EventServer in each
+# process, so streams do not hold request threads
+EVENTS_PORT = int(os.environ.get('EVENTS_PORT', 5001))
+
 MQTT_KEY = bytes.fromhex(os.environ['MQTT_KEY'])
 MQTT_USER = os.environ['MQTT_USER']
 MQTT_PASSWORD = os.environ['MQTT_PASSWORD']
+# Seconds to wait for the broker to acknowledge an action
+MQTT_PUBLISH_TIMEOUT = 2
+# Seconds a device has to acknowledge an action in its status; rebooting takes longer
+ACK_TIMEOUT = 15
+ACK_TIMEOUTS = { 'reboot': 60 }
 
-global_camera_action = {}
-global_camctl_action = {}
-global_acs_camaction = None
-global_camctl_status = None
 global_last_cameras_on = None
 
 app = Flask(__name__)
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
-app.status = {}
-app.is_space_open = False
-app.space_open_lastchange = 0 # UNIX timestamp
+app.publisher = None # MqttPublisher, set when the worker starts
 
 logger = logging.getLogger('werkzeug')
 handler = logging.handlers.RotatingFileHandler('acsgw.log', maxBytes=500*1024*1024, backupCount=5)
@@ -62,6 +120,33 @@ if os.environ.get('DEBUG', False):
     logger.addHandler(debug_handler)
 app.logger.addHandler(handler)
 
+# Several server processes share state through SQLite; a single one keeps it in memory
+app.state = SharedState(STATE_PATH, logger) if WORKERS > 0 else None
+app.status = StatusStore(logger, app.state)
+app.spaceapi = SpaceApiDocument(app.json.dumps, app.state)
+# Device status is only streamed to clients with a token
+app.events = EventBroadcaster(logger, private_events=['status'])
+if app.state:
+    app.event_relay = EventRelay(app.state, app.events, logger)
+    app.camctl = SharedCamctlActions(app.state)
+    app.camactions = SharedCameraActionQueue(app.state, logger)
+    app.acks = SharedAckTracker(app.state, logger)
+else:
+    app.event_relay = None
+    app.camctl = CamctlActions()
+    app.camactions = CameraActionQueue(logger)
+    app.acks = AckTracker(logger)
+# Where the MQTT subscriber sends events for /events subscribers
+app.event_sink = app.event_relay or app.events
+app.usage = UsageStats(USAGE_STATS_FILE, logger)
+app.slash_dispatcher = Dispatcher(logger, SLASH_WORKERS, SLASH_QUEUE_SIZE, name="slash")
+app.slash_responder = SlackResponder(make_session(SLASH_WORKERS), app.slash_dispatcher, logger)
+app.firmware = FirmwareStore(FIRMWARE_DIR, FIRMWARE_CACHE_DIR, logger, FIRMWARE_MAX_TRANSFERS)
+app.acslog = AcsLogQuery(LOG_DIR, logger)
+app.acslog_follower = AcsLogFollower(app.acslog, logger, LASTLOG_BUFFER_LINES)
+app.acslog_index = None # AcsLogIndex, set when the worker starts
+app.election = LeaderElection(LEADER_LOCK_PATH, lambda: start_ingest(), logger)
+
 # Validate Slack request using signing secret
 def is_slack_request_valid(request):
     try:
@@ -112,7 +197,7 @@ def is_slack_request_valid(request):
         logger.info('Exception validating Slack request: %s' % e)
         return False    
 
-def make_signed_payload(message):
+def make_signed_payload(message, action_id):
     hasher = hashlib.sha256()
     hasher.update(MQTT_KEY)
     now = int(time.time())
@@ -122,20 +207,63 @@ def make_signed_payload(message):
         "text": message,
         "stamp": now,
         "hash": hasher.hexdigest(),
+        # Echoed as "ack" in the device's status once carried out
+        "id": action_id,
     }
     logger.info(f"Signed payload: {data}")
     return json.dumps(data)
 
+# Publish a signed action to a device, or to all devices if device is None.
+# Returns the action ID.
 def mqtt_publish(device, payload):
-    topic = "hal9k/acs/action"
-    if device is not None:
-        topic += f"/{device}"
-    publish.single(topic,
-                   make_signed_payload(payload),
-                   hostname="mqtt.hal9k.dk",
-                   port=8883,
-                   auth={'username': MQTT_USER, 'password': MQTT_PASSWORD},
-                   tls={'tls_version': ssl.PROTOCOL_TLSv1_2, 'ca_certs': certifi.where()})
+    return mqtt_publish_all([device], payload)[device]
+
+# Publish a signed action to several devices at once, over the one connection.
+# Returns {device: action ID, or None if it could not be published}.
+def mqtt_publish_all(devices, payload):
+    # Only the action name is kept, not its argument (e.g. a token)
+    action = payload.split(' ')[0]
+    sent = {}
+    for device in devices:
+        topic = "hal9k/acs/action"
+        if device is not None:
+            topic += f"/{device}"
+        action_id = app.acks.put(device, action, ACK_TIMEOUTS.get(action, ACK_TIMEOUT))
+        sent[device] = (action_id, app.publisher.publish(topic, make_signed_payload(payload, action_id)))
+    # Wait for the broker once for all of them
+    deadline = time.monotonic() + MQTT_PUBLISH_TIMEOUT
+    for device, (action_id, future) in sent.items():
+        try:
+            future.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError as e:
+            # Still buffered or in flight; it will be delivered on reconnect
+            logger.info(f"mqtt_publish: {device}: {e}")
+        except RuntimeError as e:
+            # Rejected by the client, e.g. its buffer is full
+            logger.info(f"mqtt_publish: {device}: {e}")
+            sent[device] = (None, future)
+    return { device: action_id for device, (action_id, _) in sent.items() }
+
+# Return the devices in a group, or None if there is no such group
+def group_devices(name):
+    if name in DEVICE_GROUPS:
+        return DEVICE_GROUPS[name]
+    if name == 'all':
+        return sorted(app.status.current().acs)
+    return None
+
+def describe_ack(device, action, action_id, latency):
+    if action_id is None:
+        return f"ACS action '{action}' could not be sent to '{device}'"
+    if latency is None:
+        return (f"ACS action '{action}' sent to '{device}' (id {action_id}), " +
+                f"not acknowledged within {ACK_TIMEOUTS.get(action, ACK_TIMEOUT)} s")
+    return f"ACS action '{action}' acknowledged by '{device}' after {latency:.1f} s"
+
+class DeferredRequest:
+    """The parts of a slash command request a handler uses, kept for a deferred run."""
+    def __init__(self, form):
+        self.form = form
 
 # Validate user in /acsaction
 def is_acs_action_allowed(request):
@@ -178,8 +306,10 @@ def is_acs_request_valid(request):
 
 # Validate token in /camctl
 def is_camctl_request_valid(request):
+    return is_camctl_token_valid(request.headers.get('Authentication'))
+
+def is_camctl_token_valid(auth):
     try:
-        auth = request.headers.get('Authentication')
         cam_auth = 'Bearer %s' % os.environ['CAMCTL_VERIFICATION_TOKEN']
         acs_auth = 'Bearer %s' % os.environ['ACS_VERIFICATION_TOKEN']
         is_token_valid = (auth == cam_auth) or (auth == acs_auth)
@@ -191,34 +321,38 @@ def is_camctl_request_valid(request):
     logger.info(f"is_camctl_request_valid: {is_token_valid}")
     return is_token_valid
 
-# Return ACS status set via MQTT
-def get_acs_status():
-    status = ""
-    cutoff_time = pytz.UTC.localize(datetime.datetime.now() - datetime.timedelta(days=3))
-    for device in app.status:
-        dev_status = app.status[device]
-        if not "data" in dev_status:
-            # Not ACS frontend
-            continue
-        ts = dev_status["timestamp"]
-        # Parse ISO8601 timestamp and skip if older than 3 days
-        try:
-            ts_datetime = datetime.datetime.fromisoformat(ts)
-            if ts_datetime < cutoff_time:
-                continue
-        except (ValueError, TypeError) as e:
-            # Skip entries with invalid timestamps
-            logger.warning(f"Invalid timestamp for {device}: {ts} - {e}")
-            continue
-        status += f"*{device.capitalize()}*:\n"
-        status += f"    Last update: _{ts}_\n"
-        data = dev_status["data"]
-        for key in data:
+# Rendered status text: name -> (status snapshot version, text)
+status_cache = {}
+
+def cached_status(name, render):
+    """
+    Return rendered status text, rendering it again only if the device
+    status has changed (including devices expiring) since last time.
+    """
+    snapshot = app.status.current()
+    entry = status_cache.get(name)
+    if entry is not None and entry[0] == snapshot.version:
+        return entry[1]
+    text = render(snapshot)
+    status_cache[name] = (snapshot.version, text)
+    return text
+
+# Render ACS status set via MQTT
+def render_acs_status(snapshot):
+    lines = []
+    for device, record in snapshot.acs.items():
+        lines.append(f"*{device.capitalize()}*:")
+        lines.append(f"    Last update: _{record.timestamp}_")
+        for key, value in record.data.items():
             pretty_key = key.replace('_', ' ').capitalize()
-            pretty_data = str(data[key]).replace('_', ' ')
+            pretty_data = str(value).replace('_', ' ')
             if not pretty_data[0].isdigit():
                 pretty_data = pretty_data.capitalize()
-            status += f"    {pretty_key}: _{pretty_data}_\n"
+            lines.append(f"    {pretty_key}: _{pretty_data}_")
+    return ''.join(line + '\n' for line in lines)
+
+def get_acs_status():
+    status = cached_status('acs', render_acs_status)
     return { 'type': 'section', 'text': { 'text': status, 'type': 'mrkdwn' } }
 
 def format_lines(device, lines):
@@ -236,53 +370,21 @@ def format_lines(device, lines):
     logger.info(f'Slack logs: {json}')
     return json
 
-# Return camera status set via MQTT
-def get_camera_status_dict():
-    cam_status = {}
-    cutoff_time = pytz.UTC.localize(datetime.datetime.now() - datetime.timedelta(days=3))
-    for device in app.status:
-        if not device.startswith("cam"):
-            continue
-        dev_status = app.status[device]
-        ts = dev_status["timestamp"]
-        # Parse ISO8601 timestamp and skip if older than 3 days
-        try:
-            ts_datetime = datetime.datetime.fromisoformat(ts)
-            if ts_datetime < cutoff_time:
-                continue
-        except (ValueError, TypeError) as e:
-            # Skip entries with invalid timestamps
-            logger.warning(f"Invalid timestamp for {device}: {ts} - {e}")
-            continue
-        lp = dev_status["last_picture"]
-        ver = dev_status["version"]
-        status = { "V": ver, "H": ts, "LP": lp }
-        cam_status[int(device[3:])] = status
-    return cam_status
+# Render camera status set via MQTT
+def render_camera_status(snapshot):
+    if not snapshot.cameras:
+        return None
+    lines = []
+    for number, record in sorted(snapshot.cameras.items()):
+        lines.append(f"*{number:02d}:* V: {record.version}, H: {record.timestamp}, LP: {record.last_picture}")
+    return '\n'.join(lines)
 
 def get_camera_status():
-    cam_status = get_camera_status_dict()
-    if not cam_status:
+    status = cached_status('camera', render_camera_status)
+    if status is None:
         return 'No status'
-    logger.info(f"cam_status {cam_status}")
-    status = ''
-    for key, value in sorted(cam_status.items()):
-        if len(status) > 0:
-            status = status + '\n'
-        status = status + '*%02d:* ' % key
-        substatus = ''
-        istatus = value
-        for subkey in istatus:
-            if len(substatus) > 0:
-                substatus = substatus + ', '
-            subvalue = istatus[subkey]
-            if subkey.lower() == 'active':
-                substatus += 'Active' if subvalue == '1' else 'Inactive'
-            else:
-                substatus += '%s: %s' % (subkey, subvalue)
-        status = status + substatus
-    global global_camctl_status
-    status += f"\n*Power*: {global_camctl_status}"
+    # Power status changes on every /camctl poll, so it is not cached
+    status += f"\n*Power*: {app.camctl.get_status()}"
     return { 'type': 'section', 'text': { 'text': status, 'type': 'mrkdwn' } }
 
 def handle_acsstatus():
@@ -324,13 +426,18 @@ def handle_acsaction(request):
                 response_type='in_channel',
                 text=('This command controls the ACS. See also /camctl. Available actions:\n' +
                       ', '.join(DEVICE_ACTIONS) + ' <device>\n' +
-                      ', '.join(GLOBAL_ACTIONS)))
+                      ', '.join(GROUP_ACTIONS) + ' <group>\n' +
+                      ', '.join(GLOBAL_ACTIONS) + '\n' +
+                      'Groups: ' + ', '.join(sorted(set(DEVICE_GROUPS) | {'all'}))))
         if action in DEVICE_ACTIONS:
             return jsonify(
                 response_type='in_channel',
                 text='Missing device')
         elif action in GLOBAL_ACTIONS:
-            mqtt_publish(None, action)
+            if mqtt_publish(None, action) is None:
+                return jsonify(
+                    response_type='in_channel',
+                    text=f"ACS action '{action}' could not be sent")
             return jsonify(
                 response_type='in_channel',
                 text=f'ACS open {"is" if action == 'open' else "not"} allowed')
@@ -346,10 +453,43 @@ def handle_acsaction(request):
             action_arg = ' '.join(tokens[2:])
         if action_arg is not None:
             payload += f" {action_arg}"
-        mqtt_publish(device, payload)
+        members = group_devices(device)
+        if members is None:
+            members = [device]
+        elif action not in GROUP_ACTIONS:
+            return jsonify(
+                response_type='in_channel',
+                text=f"ACS action '{action}' cannot be sent to a group")
+        elif not members:
+            return jsonify(
+                response_type='in_channel',
+                text=f"No devices in group '{device}'")
+        action_ids = mqtt_publish_all(members, payload)
+        failed = [member for member, action_id in action_ids.items() if action_id is None]
+        sent = { member: action_id for member, action_id in action_ids.items() if action_id is not None }
+        if not isinstance(request, DeferredRequest):
+            # Cannot wait for the devices within Slack's time limit
+            lines = []
+            if sent:
+                lines.append(f"ACS action '{action}' queued for " +
+                             ', '.join(f"'{member}' (id {action_id})" for member, action_id in sent.items()))
+            if failed:
+                lines.append(f"ACS action '{action}' could not be sent to " +
+                             ', '.join(f"'{member}'" for member in failed))
+            return jsonify(
+                response_type='in_channel',
+                text='\n'.join(lines))
+        # Wait for all devices at once
+        latencies = app.acks.wait(sent.values()) if sent else {}
+        lines = [describe_ack(member, action, action_id, latencies.get(action_id))
+                 for member, action_id in action_ids.items()]
+        if members != [device]:
+            acked = sum(latency is not None for latency in latencies.values())
+            lines.insert(0, f"*ACS action '{action}' for '{device}'*: {acked} of {len(action_ids)} acknowledged" +
+                            (f", {len(failed)} not sent" if failed else ""))
         return jsonify(
             response_type='in_channel',
-            text=f"ACS action '{action}' queued for '{device}'")
+            text='\n'.join(lines))
     return jsonify(
         response_type='in_channel',
         text="ACS action '%s' not supported" % action
@@ -371,11 +511,10 @@ def handle_camaction(request, command):
     instance = int(params[0])
     action = params[1]
     if action in ['on', 'off', 'continuous', 'motion']:
-        global global_camera_action
-        global_camera_action[instance] = action
+        action_id = app.camactions.put(instance, action)
         return jsonify(
             response_type='in_channel',
-            text="Camera action '%s' queued for instance %d" % (action, instance))
+            text="Camera action '%s' queued for instance %d (id %d)" % (action, instance, action_id))
     return jsonify(
         response_type='in_channel',
         text="Camera action '%s' not supported" % action
@@ -401,8 +540,7 @@ def handle_camctl(request, command):
             text=('This command controls camera power. See also /acsaction. Available actions:\n' +
                   ', '.join(CAMCTL_ACTIONS)))
     if action in CAMCTL_ACTIONS:
-        global global_camctl_action
-        global_camctl_action = action
+        app.camctl.put_slack(action)
         return jsonify(
             response_type='in_channel',
             text="Camctl action '%s' queued" % action)
@@ -431,30 +569,146 @@ def handle_lastlog(request):
             return jsonify(
                 response_type='in_channel',
                 text='Invalid number of lines')
-    # Find the newest versioned file "acs.yyyy-mm-dd_HH"
-    pattern = '%s/acs.*' % LOG_DIR
-    files = list(filter(os.path.isfile, glob.glob(pattern)))
-    if len(files) == 0:
+    lastlines = app.acslog_follower.last_entries(device, lines)
+    if lastlines is None:
+        # More lines than are kept in memory
+        if app.acslog_index and app.acslog_index.ready:
+            lastlines = app.acslog_index.last_entries(device, lines)
+        else:
+            lastlines = app.acslog.last_entries(device, lines)
+    if lastlines is None:
         return jsonify(
             response_type='in_channel',
             text=f"No ACS logs!")
-    files.sort(key=lambda x: os.path.getmtime(x))
-    lastfile = files[-1]
-    logger.info('lastfile: %s' % lastfile)
-    file = open(lastfile, "r")
-    all_lines = list(file.readlines())
-    # Now add the current file "acs"
-    file = open('%s/acs' % LOG_DIR, "r")
-    all_lines += list(file.readlines())
-    lst = []
-    for line in all_lines:
-        parts = line.split("|")
-        if parts[1].lower() == device.lower():
-            lst.append(f"{parts[0]} {parts[2]}")
-    file.close()
-    lastlines = lst[-lines:]
     return format_lines(device, lastlines)
 
+def handle_logsearch(request):
+    text = request.form['text']
+    logger.info('logsearch: %s' % text)
+    filters = {}
+    words = []
+    for token in text.split():
+        key, sep, value = token.partition('=')
+        if sep and key in ['device', 'from', 'to', 'page']:
+            filters[key] = value
+        else:
+            words.append(token)
+    if not filters and not words:
+        return jsonify(
+            response_type='in_channel',
+            text=('Usage: /acslogsearch [device=<device>] [from=<time>] [to=<time>] [page=<n>] [text]\n' +
+                  'Times are prefixes such as 2026-10-13 or 2026-10-13_18\n' +
+                  'Each word of the text must match the start of a word in the message'))
+    try:
+        page = int(filters.get('page', 1))
+        if page < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify(
+            response_type='in_channel',
+            text='Invalid page')
+    # Times are given as 2026-10-13_18 since arguments are space separated
+    start = filters['from'].replace('_', ' ') if 'from' in filters else None
+    end = filters['to'].replace('_', ' ') if 'to' in filters else None
+    first = (page - 1) * LOGSEARCH_PAGE_LINES
+    if app.acslog_index and app.acslog_index.ready:
+        lines = app.acslog_index.search(device=filters.get('device'),
+                                        start=start,
+                                        end=end,
+                                        text=' '.join(words) if words else None,
+                                        offset=first,
+                                        limit=LOGSEARCH_PAGE_LINES + 1)
+    else:
+        results = app.acslog.search(device=filters.get('device'),
+                                    start=start,
+                                    end=end,
+                                    text=' '.join(words) if words else None)
+        lines = list(itertools.islice(results, first, first + LOGSEARCH_PAGE_LINES + 1))
+        results.close()
+    more = len(lines) > LOGSEARCH_PAGE_LINES
+    lines = lines[:LOGSEARCH_PAGE_LINES]
+    if not lines:
+        return jsonify(
+            response_type='in_channel',
+            text='No matching log lines' if page == 1 else 'No more matching log lines')
+    shown = []
+    for parts in lines:
+        line = f"{parts[0]} {parts[1]} {parts[2]}"
+        if len(line) > LOGSEARCH_MAX_LINE:
+            line = line[:LOGSEARCH_MAX_LINE - 1] + '…'
+        shown.append(line)
+    header = f"*Log search: results {first + 1}-{first + len(lines)}*\n"
+    query = ' '.join(token for token in text.split() if not token.startswith('page='))
+    footer = f"\nMore results: `/acslogsearch {query} page={page + 1}`" if more else ''
+    return jsonify(
+        response_type='in_channel',
+        blocks=[ { 'type': 'section', 'text': { 'text': header + '\n'.join(shown) + footer, 'type': 'mrkdwn' } } ],
+    )
+
+def format_usage_summary():
+    lines = ['*Usage: last 24 hours / 7 days / 30 days*']
+    for device in app.usage.device_names():
+        day = app.usage.total(device, 'hour', 24)
+        week = app.usage.total(device, 'day', 7)
+        month = app.usage.total(device, 'day', 30)
+        lines.append(f"*{device.capitalize()}*: {day} / {week} / {month}")
+    if len(lines) == 1:
+        lines.append('No usage recorded')
+    return '\n'.join(lines)
+
+def format_device_usage(device):
+    lines = [f'*Usage for {device}, per day*']
+    for start, count in app.usage.recent(device, 'day', 14):
+        lines.append(f"    {start:%a %Y-%m-%d}: {count}")
+    lines.append('*Per week*')
+    for start, count in app.usage.recent(device, 'week', 8):
+        lines.append(f"    Week {start:%V} ({start:%Y-%m-%d}): {count}")
+    # Busiest hour of the day over the last 31 days
+    by_hour = [0] * 24
+    for start, count in app.usage.recent(device, 'hour', 31 * 24):
+        by_hour[start.hour] += count
+    busiest = max(range(24), key=lambda hour: by_hour[hour])
+    if by_hour[busiest]:
+        lines.append(f"*Busiest hour (last 31 days)*: {busiest:02d}-{(busiest + 1) % 24:02d} ({by_hour[busiest]})")
+    return '\n'.join(lines)
+
+def handle_stats(request):
+    text = request.form['text'].strip()
+    logger.info('stats: %s' % text)
+    if text == 'help':
+        return jsonify(
+            response_type='in_channel',
+            text='Usage: /acsstats [device]. Shows door entries and other device events.')
+    status = format_device_usage(text.lower()) if text else format_usage_summary()
+    return jsonify(
+        response_type='in_channel',
+        blocks=[ { 'type': 'section', 'text': { 'text': status, 'type': 'mrkdwn' } } ],
+    )
+
+# Slash command -> (handler taking the request, run deferred). Deferred
+# commands may take longer than the 3 seconds Slack waits for a reply; they are
+# acknowledged at once and answered through the request's response_url.
+SLASH_COMMANDS = {
+    'status': (lambda request: handle_acsstatus(), False),
+    'acsstatus': (lambda request: handle_acsstatus(), False),
+    'camstatus': (lambda request: handle_camstatus(), False),
+    'action': (handle_acsaction, True),
+    'acsaction': (handle_acsaction, True),
+    'camaction': (lambda request: handle_camaction(request, 'camaction'), False),
+    'camctl': (lambda request: handle_camctl(request, 'camctl'), False),
+    'lastlog': (handle_lastlog, True),
+    'acslastlog': (handle_lastlog, True),
+    'logsearch': (handle_logsearch, True),
+    'acslogsearch': (handle_logsearch, True),
+    'stats': (handle_stats, False),
+    'acsstats': (handle_stats, False),
+}
+
+# Run a deferred slash command, returning the reply as a Slack message payload
+def run_slash_command(handler, form):
+    with app.app_context():
+        return handler(DeferredRequest(form)).get_json()
+
 # Handle Slack slash command.
 # /acsaction will call /slash/action, etc.
 @app.route('/slash/<command>', methods=['POST'])
@@ -463,19 +717,15 @@ def command(command):
         logger.info('Invalid Slack request. Aborting')
         return abort(403)
     logger.info('Slack command received: %s' % command)
-    if command == 'status' or command == 'acsstatus':
-        return handle_acsstatus()
-    if command == 'camstatus':
-        return handle_camstatus()
-    if command == 'action' or command == 'acsaction':
-        return handle_acsaction(request)
-    if command == 'camaction':
-        return handle_camaction(request, command)
-    if command == 'camctl':
-        return handle_camctl(request, command)
-    if command == 'lastlog' or command == 'acslastlog':
-        return handle_lastlog(request)
-    return 'Unknown command', 200
+    if command not in SLASH_COMMANDS:
+        return 'Unknown command', 200
+    handler, deferred = SLASH_COMMANDS[command]
+    if deferred and app.slash_responder.defer(request.form.get('response_url'),
+                                              run_slash_command, handler, request.form.copy()):
+        return jsonify(
+            response_type='ephemeral',
+            text='Working on it...')
+    return handler(request)
 
 # /acscamctl: Called by ACS to control camera power
 @app.route('/acscamctl', methods=['POST'])
@@ -483,15 +733,65 @@ def acscamctl():
     if not is_acs_request_valid(request):
         logger.info('Invalid request. Aborting')
         return abort(403)
-    global global_acs_camaction
-    global_acs_camaction = request.json['action']
-    logger.info('acscamctl: action %s' % global_acs_camaction)
+    action = request.json['action']
+    app.camctl.put_acs(action)
+    logger.info('acscamctl: action %s' % action)
     return '', 200
 
+# /firmware/manifest: Name, size, hash and version of all firmware images
+@app.route('/firmware/manifest', methods=['GET'])
+def firmware_manifest():
+    body, etag = app.firmware.get_manifest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # /firmware: Called by ACS to fetch firmware image
 @app.route('/firmware/<image>', methods=['GET'])
 def firmware(image):
-    return send_file(f'{FIRMWARE_DIR}/{image}.bin')
+    # Compressed variants are only sent to clients that ask for them
+    encodings = [e for e in ('gzip', 'deflate') if request.accept_encodings[e]]
+    found = app.firmware.open(image, encodings)
+    if found is None:
+        return abort(404)
+    file, info, encoding, size, etag = found
+    headers = { 'ETag': f'"{etag}"', 'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache',
+                'Vary': 'Accept-Encoding' }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if request.if_none_match.contains(etag):
+        file.close()
+        return '', 304, headers
+    start, stop = 0, size
+    # If-Range: resume only if the image has not changed since the first part
+    byte_range = request.range
+    if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 and \
+            ('If-Range' not in request.headers or request.if_range.etag == etag):
+        byte_range = byte_range.range_for_length(size)
+        if byte_range is None:
+            file.close()
+            headers['Content-Range'] = f'bytes */{size}'
+            return '', 416, headers
+        start, stop = byte_range
+    if not app.firmware.acquire():
+        file.close()
+        logger.info(f'firmware: too many transfers, rejecting {image}')
+        headers['Retry-After'] = str(FIRMWARE_RETRY_AFTER)
+        return 'Too many transfers', 503, headers
+    # Passed through as is, so the body releases the transfer slot when closed
+    body = file_body(file, start, stop - start, request.environ, app.firmware.release)
+    response = app.response_class(body,
+                                  status=200, headers=headers, mimetype='application/octet-stream',
+                                  direct_passthrough=True)
+    response.content_length = stop - start
+    if stop - start != size:
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return response
 
 # Get camctl parameters, store status
 @app.route('/camctl', methods=['GET'])
@@ -514,75 +814,145 @@ def get_camctl():
     # if cameras_on != global_last_cameras_on:
     #     slack_write(':camera: Cameras are %s' % ('on' if cameras_on == '1' else 'off'))
     #     global_last_cameras_on = cameras_on
-    global global_camctl_action
-    action = global_camctl_action
-    global_camctl_action = None
-    global global_acs_camaction
-    if not action:
-        if global_acs_camaction:
-            action = global_acs_camaction
-            global_acs_camaction = None
     status.append(f" H: {datetime.datetime.now().replace(microsecond=0).strftime('%Y-%m-%d %H:%M:%S')}")
-    global global_camctl_status
-    global_camctl_status = ", ".join(status)
+    app.camctl.set_status(", ".join(status))
+    # ?wait=N: long-poll up to N seconds for an action
+    wait = request.args.get('wait', default=0, type=float)
+    action = app.camctl.take(max(0, min(wait, CAMCTL_MAX_WAIT)))
     return jsonify(action=action)
 
+# Fetch pending actions for one camera
+@app.route('/camaction/<int:instance>', methods=['GET'])
+def get_camaction(instance):
+    if not is_camctl_request_valid(request):
+        logger.info('Invalid camaction request. Aborting')
+        return abort(403)
+    # ?wait=N: long-poll up to N seconds for an action
+    wait = request.args.get('wait', default=0, type=float)
+    actions = app.camactions.fetch(instance, max(0, min(wait, CAMCTL_MAX_WAIT)))
+    return jsonify(actions=[{ 'id': action_id, 'action': action } for action_id, action in actions])
+
+# Acknowledge actions carried out by a camera
+@app.route('/camaction/<int:instance>/ack', methods=['POST'])
+def ack_camaction(instance):
+    if not is_camctl_request_valid(request):
+        logger.info('Invalid camaction ack request. Aborting')
+        return abort(403)
+    ids = request.get_json(silent=True, force=True)
+    if not isinstance(ids, dict) or not isinstance(ids.get('ids'), list):
+        return abort(400)
+    removed = app.camactions.ack(instance, ids['ids'])
+    logger.info(f'camaction: instance {instance} acknowledged {removed} actions')
+    return jsonify(acknowledged=removed)
+
 # /spaceapi: SpaceAPI
 @app.route('/spaceapi', methods=['GET'])
 @cross_origin()
 def spaceapi():
-    info = {
-        "api_compatibility": ["14"],
-        "space": "Hal9k",
-        "logo": "https://hal9k.dk/wp-content/uploads/2012/10/hal9k_log-sky2.png",
-        "url": "https://hal9k.dk",
-        "location": {
-            "address": "Sofiendalsvej 80, 9000 Aalborg, Denmark",
-            "lon": 9.882,
-            "lat": 57.0187,
-            "timezone": "Europe/Copenhagen"
-        },
-        "contact": {
-            "email": "bestyrelse@hal9k.dk"
-        },
-        "state": {
-            "open": app.is_space_open,
-            "lastchange": app.space_open_lastchange
-        },
-        "projects": [
-            "https://wiki.hal9k.dk"
-        ],
-        "membership_plans": [
-            {
-                "name": "Normal membership",
-                "value": 450,
-                "currency": "DKK",
-                "billing_interval": "other",
-                "description": "Billing is once per quarter"
-            },
-            {
-                "name": "Student membership",
-                "value": 225,
-                "currency": "DKK",
-                "billing_interval": "other",
-                "description": "Billing is once per quarter"
-            }
-        ]
-    }
-    return jsonify(info)
-
-
-# Start the server on port 5000
-if __name__ == '__main__':
-    WSGIRequestHandler.protocol_version = "HTTP/1.1"
-    # Create MQTT client
-    mqtt_client = AcsMqtt(logger, userdata=app)
+    current = app.spaceapi.current()
+    # q=0 means the client refuses gzip
+    gzipped = bool(request.accept_encodings['gzip'])
+    etag = current.gzip_etag if gzipped else current.etag
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    elif gzipped:
+        response = app.response_class(current.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(current.body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={SPACEAPI_MAX_AGE}'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# /events: Server-Sent Events with space changes, and device status changes
+# for clients with the camctl or ACS token
+def events_access(headers):
+    """True if the client may see device status, None if only space events, False for a bad token."""
+    auth = headers.get('authentication')
+    if auth is None:
+        return None
+    return is_camctl_token_valid(auth)
+
+def events_initial(private):
+    """Frames a new /events client starts with: the current state."""
+    initial = [app.events.encode('space', app.spaceapi.space())]
+    if private:
+        for device, record in app.status.current().devices.items():
+            initial.append(app.events.encode('status', { 'device': device, 'status': record.raw }))
+    return initial
+
+@app.route('/events', methods=['GET'])
+@cross_origin()
+def events():
+    if WORKERS > 0:
+        return f'Served on port {EVENTS_PORT}', 404
+    private = events_access(request.headers)
+    if private is False:
+        return abort(403)
+    if app.events.is_full():
+        return 'Too many subscribers', 503
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    # New clients start with the current state; resumed ones already have it
+    initial = events_initial(private) if last_event_id is None else []
+    response = Response(app.events.stream(last_event_id, initial, bool(private)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Do not let a reverse proxy buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def connect_mqtt(client):
     ctx = ssl.create_default_context(cafile=certifi.where())
-    mqtt_client.tls_set_context(ctx)
-    mqtt_client.connect("mqtt.hal9k.dk", 8883)
-    mqtt_client.loop_start()
+    client.tls_set_context(ctx)
+    client.connect("mqtt.hal9k.dk", 8883)
+    client.loop_start()
+    return client
+
+# Start the threads every server process runs. Called in each worker after it
+# has been forked.
+def start_worker():
+    # With several processes each one has a connection for publishing
+    # actions; a single process publishes on the subscriber's connection
+    if WORKERS > 0:
+        app.publisher = connect_mqtt(MqttClient(logger, userdata=app)).publisher
+    # Run slow slash commands in the background
+    app.slash_dispatcher.start()
+    # Pass events written by the MQTT subscriber on to /events subscribers,
+    # served outside the request threads
+    if app.event_relay:
+        app.event_relay.start()
+        EventServer(app.events, ('0.0.0.0', EVENTS_PORT), events_access, events_initial,
+                    logger, CLIENT_TIMEOUT).start()
+    # Follow the ACS log for /lastlog
+    app.acslog_follower.start()
+    app.acslog_index = AcsLogIndex(LOG_INDEX_PATH, app.acslog, logger)
+    # Compress new firmware images and keep /firmware/manifest current
+    app.firmware.start()
+    # One process runs the MQTT subscriber; another takes over if it exits
+    if WORKERS > 0:
+        app.election.start()
+
+# Start the threads only one server process runs
+def start_ingest():
+    app.usage.start()
+    # Create MQTT client
+    client = connect_mqtt(AcsMqtt(logger, userdata=app))
+    if app.publisher is None:
+        app.publisher = client.publisher
     # Check ACS_SYNC_STATUS_FILE every 60 seconds
-    watcher = SyncWatcher(ACS_SYNC_STATUS_FILE, MQTT_USER, MQTT_PASSWORD, 60, logger)
+    watcher = SyncWatcher(ACS_SYNC_STATUS_FILE, app.publisher, 60, logger)
     watcher.start()
-    # Start HTTP server
-    app.run(host='0.0.0.0', port=5000)
+    app.acslog_index.start()
+
+# Start the server on port 5000
+if __name__ == '__main__':
+    if WORKERS > 0:
+        WsgiServer(app, '0.0.0.0:5000', WORKERS, THREADS, start_worker, CLIENT_TIMEOUT).run()
+    else:
+        WSGIRequestHandler.protocol_version = "HTTP/1.1"
+        # Disconnect clients that stop reading, e.g. /events subscribers
+        WSGIRequestHandler.timeout = CLIENT_TIMEOUT
+        start_worker()
+        start_ingest()
+        # Start HTTP server
+        app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,128 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+class SharedState:
+    def __init__(self, path, logger, poll_interval=0.1):
+        """
+        Initialize the SharedState.
+
+        State written by one process or thread and read by others (device
+        status, space state, queued camera actions) is kept in an SQLite
+        database in WAL mode, so every server worker process sees the same
+        state. Components create their own tables with create_tables().
+
+        Connections are pooled per process and never shared across a fork.
+        Writes in this process wake waiters in this process immediately;
+        changes made by other processes are picked up by polling every
+        poll_interval seconds.
+
+        Args:
+            path: Path of the state database
+            logger: Logger instance (optional)
+            poll_interval: Maximum seconds wait() blocks before waiters check again
+        """
+        self.path = path
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        # (pid, idle connections); connections are never used across a fork
+        self.pool = (os.getpid(), [])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.create_tables("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                version INTEGER NOT NULL DEFAULT 0);
+        """)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _acquire(self):
+        with self.lock:
+            pid, idle = self.pool
+            if pid != os.getpid():
+                # Forked: the parent's connections belong to the parent
+                idle = []
+                self.pool = (os.getpid(), idle)
+            if idle:
+                return idle.pop()
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _release(self, db):
+        with self.lock:
+            if self.pool[0] == os.getpid():
+                self.pool[1].append(db)
+                return
+        db.close()
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Borrow a connection in autocommit mode."""
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            self._release(db)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Borrow a connection in a write transaction, committed on success."""
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        self.notify()
+
+    def create_tables(self, script):
+        with self.connect() as db:
+            db.executescript(script)
+
+    def notify(self):
+        """Wake the waiters in this process."""
+        with self.cond:
+            self.cond.notify_all()
+
+    def wait(self, timeout):
+        """
+        Wait until state changes in this process, or at most poll_interval
+        seconds so that changes by other processes are noticed.
+        """
+        with self.cond:
+            self.cond.wait(max(0, min(timeout, self.poll_interval)))
+
+    def get(self, key, default=None):
+        """Return (value, version) for a key, or (default, 0) if it is not set."""
+        with self.connect() as db:
+            row = db.execute("SELECT value, version FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default, 0
+        return json.loads(row[0]), row[1]
+
+    def version(self, key):
+        """Return the number of times a key has been set."""
+        with self.connect() as db:
+            row = db.execute("SELECT version FROM kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, key, value, db=None):
+        """Set a key to a JSON value. Returns the new version."""
+        if db is None:
+            with self.transaction() as db:
+                return self.set(key, value, db)
+        return db.execute("""INSERT INTO kv (key, value, version) VALUES (?, ?, 1)
+                             ON CONFLICT (key) DO UPDATE SET value = excluded.value, version = version + 1
+                             RETURNING version""",
+                          (key, json.dumps(value))).fetchone()[0]
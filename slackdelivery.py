@@ -0,0 +1,174 @@
+import collections
+import threading
+import time
+
+from dispatcher import PRIORITY_SLACK
+
+SLACK_POST_URL = 'https://slack.com/api/chat.postMessage'
+
+class ChannelState:
+    """Pending messages and pacing state for one Slack channel."""
+    __slots__ = ('pending', 'tokens', 'refilled', 'blocked_until', 'in_flight')
+
+    def __init__(self, burst, now):
+        self.pending = collections.deque()
+        self.tokens = burst
+        self.refilled = now
+        self.blocked_until = 0
+        self.in_flight = False
+
+class SlackDelivery:
+    def __init__(self, session, token, dispatcher, logger,
+                 rate=1.0, burst=1, max_pending=100, max_attempts=5):
+        """
+        Initialize the SlackDelivery.
+
+        Messages are paced per channel with a token bucket and posted one at
+        a time per channel, so ordering within a channel is preserved.
+        HTTP 429 responses are retried after the Retry-After delay; other
+        non-2xx responses count as failed.
+
+        Args:
+            session: requests session used for posting
+            token: Slack bot token
+            dispatcher: Dispatcher that performs the HTTP calls
+            logger: Logger instance (optional)
+            rate: Messages per second per channel
+            burst: Token bucket size per channel
+            max_pending: Maximum number of queued messages per channel; the
+                         oldest message is dropped when this is exceeded
+            max_attempts: Attempts per message before it is dropped
+        """
+        self.session = session
+        self.token = token
+        self.dispatcher = dispatcher
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.channels = {}
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.counters = collections.Counter()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def send(self, channel, text, priority=PRIORITY_SLACK):
+        """Queue a message for a channel. Never blocks."""
+        with self.cond:
+            state = self.channels.get(channel)
+            if state is None:
+                state = self.channels[channel] = ChannelState(self.burst, time.monotonic())
+            if len(state.pending) >= self.max_pending:
+                _, dropped, _ = state.pending.popleft()
+                self.counters['dropped'] += 1
+                self.log_info(f"slack: #{channel} backlog full, dropping: {dropped}")
+            state.pending.append((priority, text, 0))
+            self.cond.notify()
+
+    def _ready_at(self, state, now):
+        """Return the earliest time the next message for a channel may be posted."""
+        elapsed = now - state.refilled
+        state.tokens = min(self.burst, state.tokens + elapsed * self.rate)
+        state.refilled = now
+        ready = now if state.tokens >= 1 else now + (1 - state.tokens) / self.rate
+        return max(ready, state.blocked_until)
+
+    def _schedule_loop(self):
+        """Main loop for the scheduler thread."""
+        with self.cond:
+            while self.running:
+                now = time.monotonic()
+                wakeup = None
+                for channel, state in self.channels.items():
+                    if state.in_flight or not state.pending:
+                        continue
+                    ready = self._ready_at(state, now)
+                    if ready > now:
+                        wakeup = ready if wakeup is None else min(wakeup, ready)
+                        continue
+                    state.tokens -= 1
+                    priority, text, attempts = state.pending.popleft()
+                    state.in_flight = True
+                    if not self.dispatcher.submit(priority, self._post, channel, text, priority, attempts,
+                                                  on_evict=self._evicted):
+                        state.in_flight = False
+                        self.counters['dropped'] += 1
+                self.cond.wait(None if wakeup is None else wakeup - now)
+
+    def _post(self, channel, text, priority, attempts):
+        """Post one message. Runs on a dispatcher worker."""
+        retry_after = None
+        outcome = 'failed'
+        try:
+            body = { 'channel': channel, 'icon_emoji': ':panopticon:', 'parse': 'full', 'text': text }
+            headers = {
+                    'content_type': 'application/json',
+                    'Authorization': 'Bearer %s' % self.token
+                }
+            r = self.session.post(url = SLACK_POST_URL, data = body, headers = headers)
+            self.log_info(f"slack_write: {r}")
+            if r.status_code == 429:
+                try:
+                    retry_after = float(r.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1
+            elif 200 <= r.status_code < 300:
+                # Slack reports most errors (bad channel, token) in a 200 response
+                result = r.json()
+                if result.get('ok'):
+                    outcome = 'sent'
+                else:
+                    self.log_info(f"slack: #{channel} post failed: {result.get('error')}: {text}")
+        except Exception as e:
+            self.log_info(f"Slack exception: {e}")
+        with self.cond:
+            if retry_after is None:
+                self.counters[outcome] += 1
+            state = self.channels[channel]
+            state.in_flight = False
+            if retry_after is not None:
+                state.blocked_until = time.monotonic() + retry_after
+                if attempts + 1 < self.max_attempts:
+                    self.counters['delayed'] += 1
+                    self.log_info(f"slack: #{channel} rate limited, retrying in {retry_after}s")
+                    state.pending.appendleft((priority, text, attempts + 1))
+                else:
+                    self.counters['dropped'] += 1
+                    self.log_info(f"slack: #{channel} rate limited, giving up: {text}")
+            self.cond.notify()
+
+    def _evicted(self, channel, text, priority, attempts):
+        """Release a channel whose post was evicted from the dispatcher queue."""
+        with self.cond:
+            self.channels[channel].in_flight = False
+            self.counters['dropped'] += 1
+            self.log_info(f"slack: #{channel} post evicted, dropping: {text}")
+            self.cond.notify()
+
+    def stats(self):
+        """Return delivery counters and current backlog."""
+        with self.cond:
+            stats = dict(self.counters)
+            stats['queued'] = sum(len(state.pending) for state in self.channels.values())
+        return stats
+
+    def start(self):
+        """Start the scheduler thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._schedule_loop, name="slack-delivery", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread."""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,72 @@
+import collections
+
+from dispatcher import PRIORITY_SLACK
+
+# Slack only gives out response URLs on this host
+SLACK_RESPONSE_URL_PREFIX = 'https://hooks.slack.com/'
+
+class SlackResponder:
+    def __init__(self, session, dispatcher, logger, url_prefix=SLACK_RESPONSE_URL_PREFIX):
+        """
+        Initialize the SlackResponder.
+
+        Slack waits at most 3 seconds for the reply to a slash command.
+        Commands that may take longer are acknowledged at once and run on a
+        dispatcher worker, which posts the reply to the command's
+        response_url (valid for 30 minutes) over the pooled session.
+
+        Args:
+            session: requests session used for posting
+            dispatcher: Dispatcher that runs the commands
+            logger: Logger instance (optional)
+            url_prefix: Response URLs must start with this
+        """
+        self.session = session
+        self.dispatcher = dispatcher
+        self.logger = logger
+        self.url_prefix = url_prefix
+        self.counters = collections.Counter()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def defer(self, response_url, func, *args):
+        """
+        Run func(*args) in the background and post the message it returns
+        (a Slack message payload dict) to response_url. Never blocks.
+        Returns False if the command must be run inline instead: the
+        response URL is missing or not Slack's, or the queue is full.
+        """
+        if not response_url or not response_url.startswith(self.url_prefix):
+            return False
+        if not self.dispatcher.submit(PRIORITY_SLACK, self._run, response_url, func, args):
+            self.counters['rejected'] += 1
+            return False
+        return True
+
+    def _run(self, response_url, func, args):
+        """Run one command and post its reply. Runs on a dispatcher worker."""
+        try:
+            message = func(*args)
+        except Exception as e:
+            self.log_info(f"SlackResponder: {func.__name__} exception: {e}")
+            message = { 'response_type': 'ephemeral', 'text': 'Internal error' }
+        self.respond(response_url, message)
+
+    def respond(self, response_url, message):
+        """Post a message to a response URL. Returns True if Slack accepted it."""
+        try:
+            r = self.session.post(response_url, json=message)
+            if r.status_code == 200:
+                self.counters['sent'] += 1
+                return True
+            self.log_info(f"SlackResponder: {r.status_code} {r.text}")
+        except Exception as e:
+            self.log_info(f"SlackResponder exception: {e}")
+        self.counters['failed'] += 1
+        return False
+
+    def stats(self):
+        """Return reply counters."""
+        return dict(self.counters)
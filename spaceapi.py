@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import time
+
+SPACEAPI_INFO = {
+    "api_compatibility": ["14"],
+    "space": "Hal9k",
+    "logo": "https://hal9k.dk/wp-content/uploads/2012/10/hal9k_log-sky2.png",
+    "url": "https://hal9k.dk",
+    "location": {
+        "address": "Sofiendalsvej 80, 9000 Aalborg, Denmark",
+        "lon": 9.882,
+        "lat": 57.0187,
+        "timezone": "Europe/Copenhagen"
+    },
+    "contact": {
+        "email": "bestyrelse@hal9k.dk"
+    },
+    "projects": [
+        "https://wiki.hal9k.dk"
+    ],
+    "membership_plans": [
+        {
+            "name": "Normal membership",
+            "value": 450,
+            "currency": "DKK",
+            "billing_interval": "other",
+            "description": "Billing is once per quarter"
+        },
+        {
+            "name": "Student membership",
+            "value": 225,
+            "currency": "DKK",
+            "billing_interval": "other",
+            "description": "Billing is once per quarter"
+        }
+    ]
+}
+
+class SpaceApiBody:
+    """A serialized SpaceAPI document and its gzip variant, each with its own ETag."""
+    __slots__ = ('body', 'gzip_body', 'etag', 'gzip_etag')
+
+    def __init__(self, body):
+        self.body = body
+        self.gzip_body = gzip.compress(body, mtime=0)
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        # The compressed bytes differ, so caches must not mix them up
+        self.gzip_etag = f"{self.etag}-gz"
+
+# Space state before the first status message
+SPACE_CLOSED = { "open": False, "lastchange": 0 }
+
+class SpaceApiDocument:
+    def __init__(self, dumps=json.dumps, state=None):
+        """
+        Initialize the SpaceApiDocument.
+
+        The document is serialized only when the space state ({"open",
+        "lastchange"}) changes; the endpoint serves the current bytes as
+        they are.
+
+        With a SharedState, the space state is kept in it under 'space',
+        and the document is serialized again when another process has
+        changed it.
+
+        Args:
+            dumps: JSON serializer, e.g. the Flask app's app.json.dumps
+            state: SharedState (optional)
+        """
+        self.dumps = dumps
+        self.state = state
+        self.space_state = SPACE_CLOSED
+        # Version of the shared space state the body reflects
+        self.synced = None
+        self.body = None
+        self._serialize(SPACE_CLOSED)
+
+    def _serialize(self, space):
+        info = dict(SPACEAPI_INFO, state=space)
+        body = f"{self.dumps(info, separators=(',', ':'))}\n".encode('utf-8')
+        # Replaced in one assignment, so readers see either the old or the new body
+        self.body = SpaceApiBody(body)
+
+    def space(self):
+        """Return the space state."""
+        if self.state:
+            return self.state.get('space', SPACE_CLOSED)[0]
+        return self.space_state
+
+    def set_open(self, is_open):
+        """Record the space state. Returns True if it changed."""
+        if not self.state:
+            if self.space_state["open"] == is_open:
+                return False
+            self.space_state = { "open": is_open, "lastchange": int(time.time()) }
+            self._serialize(self.space_state)
+            return True
+        with self.state.transaction() as db:
+            row = db.execute("SELECT value FROM kv WHERE key = 'space'").fetchone()
+            if row is not None and json.loads(row[0])["open"] == is_open:
+                return False
+            self.state.set('space', { "open": is_open, "lastchange": int(time.time()) }, db)
+            return True
+
+    def current(self):
+        """Return the SpaceApiBody for the current space state."""
+        if self.state and self.state.version('space') != self.synced:
+            space, self.synced = self.state.get('space', SPACE_CLOSED)
+            self._serialize(space)
+        return self.body
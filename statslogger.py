@@ -0,0 +1,56 @@
+import threading
+
+class StatsLogger:
+    def __init__(self, sources, interval, logger):
+        """
+        Initialize the StatsLogger.
+
+        Logs one line with the counters of the background components every
+        interval seconds, e.g.
+        "stats: slack sent=12 failed=0 | dispatcher queued=0 dropped=0".
+
+        Args:
+            sources: Maps a name to a function returning a dict of counters
+            interval: Seconds between log lines
+            logger: Logger instance (optional)
+        """
+        self.sources = dict(sources)
+        self.interval = interval
+        self.logger = logger
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def format(self):
+        """Return the current counters as one line."""
+        parts = []
+        for name, stats in self.sources.items():
+            try:
+                counters = stats()
+            except Exception as e:
+                counters = { 'error': e }
+            parts.append(' '.join([name] + [f"{key}={value}" for key, value in counters.items()]))
+        return "stats: " + " | ".join(parts)
+
+    def _log_loop(self):
+        """Main loop for the logger thread."""
+        while not self.stopped.wait(self.interval):
+            self.log_info(self.format())
+
+    def start(self):
+        """Start the logger thread."""
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self._log_loop, name="stats-logger", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the logger thread, logging the counters a last time."""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+            self.log_info(self.format())
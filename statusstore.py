@@ -0,0 +1,220 @@
+import datetime
+import heapq
+import json
+import threading
+import time
+
+# Devices that have been silent for longer than this are dropped
+STATUS_MAX_AGE = datetime.timedelta(days=3)
+
+class DeviceStatus:
+    """Status of one device, parsed once when it arrives."""
+    __slots__ = ('device', 'timestamp', 'time', 'expires', 'raw')
+
+    def __init__(self, device, timestamp, ts_datetime, raw):
+        self.device = device
+        self.timestamp = timestamp
+        self.time = ts_datetime.timestamp()
+        self.expires = (ts_datetime + STATUS_MAX_AGE).timestamp()
+        self.raw = raw
+
+class AcsStatus(DeviceStatus):
+    """Status of an ACS frontend."""
+    __slots__ = ('data',)
+
+    def __init__(self, device, timestamp, ts_datetime, raw):
+        super().__init__(device, timestamp, ts_datetime, raw)
+        self.data = raw["data"]
+
+class CameraStatus(DeviceStatus):
+    """Status of a camera 'camNN'."""
+    __slots__ = ('number', 'version', 'last_picture')
+
+    def __init__(self, device, timestamp, ts_datetime, raw):
+        super().__init__(device, timestamp, ts_datetime, raw)
+        self.number = int(device[3:])
+        self.version = raw["version"]
+        self.last_picture = raw["last_picture"]
+
+class StatusSnapshot:
+    """Immutable view of all device status. Never modified once published."""
+    __slots__ = ('version', 'devices', 'acs', 'cameras')
+
+    def __init__(self, version, devices, acs, cameras):
+        self.version = version
+        self.devices = devices
+        self.acs = acs
+        self.cameras = cameras
+
+class StatusStore:
+    def __init__(self, logger, state=None):
+        """
+        Initialize the StatusStore.
+
+        Device status is written by the MQTT thread and published as
+        copy-on-write snapshots, so readers never need a lock. ACS frontends
+        (status with "data") and cameras ("camNN") are indexed separately.
+        A heap of expiry times drops devices that have been silent for
+        longer than STATUS_MAX_AGE without scanning every entry.
+
+        With a SharedState, status is also written to it, and the snapshot
+        is reloaded whenever another process has written newer status.
+
+        Args:
+            logger: Logger instance (optional)
+            state: SharedState (optional)
+        """
+        self.logger = logger
+        self.state = state
+        self.lock = threading.Lock()
+        self.snapshot = StatusSnapshot(0, {}, {}, {})
+        # (expiry time, device)
+        self.expiry = []
+        # Version of the shared status the snapshot reflects
+        self.synced = 0
+        if state:
+            state.create_tables("""
+                CREATE TABLE IF NOT EXISTS status (
+                    device TEXT PRIMARY KEY,
+                    raw TEXT NOT NULL,
+                    expires REAL NOT NULL);
+            """)
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def parse(self, device, raw):
+        """Return the status record for a device, or None if it is invalid or too old."""
+        try:
+            timestamp = raw["timestamp"]
+            ts_datetime = datetime.datetime.fromisoformat(timestamp)
+            if ts_datetime.tzinfo is None:
+                raise ValueError("timestamp has no timezone")
+            if "data" in raw:
+                record = AcsStatus(device, timestamp, ts_datetime, raw)
+            elif device.startswith("cam"):
+                record = CameraStatus(device, timestamp, ts_datetime, raw)
+            else:
+                record = DeviceStatus(device, timestamp, ts_datetime, raw)
+        except (KeyError, ValueError, TypeError) as e:
+            self.log_info(f"Invalid status for {device}: {raw} - {e}")
+            return None
+        if record.expires <= time.time():
+            return None
+        return record
+
+    def _publish(self, devices, acs, cameras):
+        self.snapshot = StatusSnapshot(self.snapshot.version + 1, devices, acs, cameras)
+
+    def _write_shared(self, device, record):
+        """Write status to the shared state. Returns the new shared version."""
+        with self.state.transaction() as db:
+            if record is None:
+                db.execute("DELETE FROM status WHERE device = ?", (device,))
+            else:
+                # Update in place, so the device keeps its position
+                db.execute("""INSERT INTO status (device, raw, expires) VALUES (?, ?, ?)
+                              ON CONFLICT (device) DO UPDATE SET raw = excluded.raw, expires = excluded.expires""",
+                           (device, json.dumps(record.raw), record.expires))
+            db.execute("DELETE FROM status WHERE expires <= ?", (time.time(),))
+            return self.state.set('status', None, db)
+
+    def update(self, device, raw):
+        """Store the status of a device. Returns the new record, or None if it is invalid."""
+        record = self.parse(device, raw)
+        if self.state:
+            version = self._write_shared(device, record)
+        with self.lock:
+            if self.state:
+                if version != self.synced + 1:
+                    # Another process wrote status too; reload instead
+                    return record
+                self.synced = version
+            snapshot = self.snapshot
+            devices = dict(snapshot.devices)
+            acs = snapshot.acs
+            cameras = snapshot.cameras
+            old = devices.pop(device, None) if record is None else devices.get(device)
+            if record is not None:
+                devices[device] = record
+                heapq.heappush(self.expiry, (record.expires, device))
+                if len(self.expiry) > 4 * len(devices) + 64:
+                    # Drop entries superseded by newer status
+                    self.expiry = [(r.expires, d) for d, r in devices.items()]
+                    heapq.heapify(self.expiry)
+            # Only copy the indexes that change. Existing keys are assigned in
+            # place, so the order of /acsstatus and /camstatus stays stable.
+            if isinstance(old, AcsStatus) or isinstance(record, AcsStatus):
+                acs = dict(acs)
+                if isinstance(record, AcsStatus):
+                    acs[device] = record
+                else:
+                    acs.pop(device, None)
+            if isinstance(old, CameraStatus) or isinstance(record, CameraStatus):
+                cameras = dict(cameras)
+                if isinstance(record, CameraStatus):
+                    cameras[record.number] = record
+                else:
+                    cameras.pop(old.number, None)
+            self._publish(devices, acs, cameras)
+            self._expire(time.time())
+        return record
+
+    def _expire(self, now):
+        """Drop devices whose newest status has expired. Called with the lock held."""
+        expired = []
+        while self.expiry and self.expiry[0][0] <= now:
+            expires, device = heapq.heappop(self.expiry)
+            record = self.snapshot.devices.get(device)
+            # Skip heap entries superseded by a newer status
+            if record is not None and record.expires == expires:
+                expired.append(record)
+        if not expired:
+            return
+        snapshot = self.snapshot
+        devices = dict(snapshot.devices)
+        acs = dict(snapshot.acs)
+        cameras = dict(snapshot.cameras)
+        for record in expired:
+            self.log_info(f"Status for {record.device} expired")
+            del devices[record.device]
+            acs.pop(record.device, None)
+            if isinstance(record, CameraStatus):
+                cameras.pop(record.number, None)
+        self._publish(devices, acs, cameras)
+
+    def _sync(self):
+        """Reload the snapshot if the shared status has changed."""
+        version = self.state.version('status')
+        if version == self.synced:
+            return
+        with self.state.connect() as db:
+            rows = db.execute("SELECT device, raw FROM status ORDER BY rowid").fetchall()
+        records = [self.parse(device, json.loads(raw)) for device, raw in rows]
+        with self.lock:
+            devices = {}
+            acs = {}
+            cameras = {}
+            for record in records:
+                if record is None:
+                    continue
+                devices[record.device] = record
+                if isinstance(record, AcsStatus):
+                    acs[record.device] = record
+                elif isinstance(record, CameraStatus):
+                    cameras[record.number] = record
+            self.expiry = [(r.expires, d) for d, r in devices.items()]
+            heapq.heapify(self.expiry)
+            self._publish(devices, acs, cameras)
+            self.synced = version
+
+    def current(self):
+        """Return the current snapshot, after dropping expired devices."""
+        if self.state:
+            self._sync()
+        expiry = self.expiry
+        if expiry and expiry[0][0] <= time.time():
+            with self.lock:
+                self._expire(time.time())
+        return self.snapshot
@@ -5,23 +5,19 @@ import threading
 import time
 from datetime import datetime, timezone
 
-import paho.mqtt.publish as publish
-import certifi
-import ssl
-
 class SyncWatcher:
-    def __init__(self, sync_file, mqtt_user, mqtt_password, interval, logger):
+    def __init__(self, sync_file, publisher, interval, logger):
         """
         Initialize the SyncWatcher.
         
         Args:
             sync_file: Path to the file to watch for timestamp changes
+            publisher: MqttPublisher used to publish the status
             interval: Check interval in seconds (default: 60)
             logger: Logger instance (optional)
         """
         self.sync_file = sync_file
-        self.mqtt_user = mqtt_user
-        self.mqtt_password = mqtt_password
+        self.publisher = publisher
         self.interval = interval
         self.logger = logger
         self.running = False
@@ -61,12 +57,8 @@ class SyncWatcher:
             }
             
             payload = json.dumps(message)
-            publish.single("hal9k/acs/status/sync", payload,
-                           hostname="mqtt.hal9k.dk",
-                           port=8883,
-                           auth={'username': self.mqtt_user, 'password': self.mqtt_password},
-                           tls={'tls_version': ssl.PROTOCOL_TLSv1_2, 'ca_certs': certifi.where()},
-                           retain=True)
+            future = self.publisher.publish("hal9k/acs/status/sync", payload, retain=True)
+            future.result(timeout=self.interval)
             self.log_info(f"Published sync status: {payload}")
         except Exception as e:
             self.log_info(f"Error publishing status: {e}")
@@ -0,0 +1,221 @@
+import array
+import datetime
+import json
+import os
+import threading
+import time
+
+import pytz
+
+TIMEZONE = pytz.timezone('Europe/Copenhagen')
+
+# Resolution name -> (bucket size in seconds, number of buckets kept)
+RESOLUTIONS = {
+    'hour': (3600, 31 * 24),
+    'day': (86400, 366),
+    'week': (7 * 86400, 104),
+}
+
+def local_seconds(ts):
+    """Seconds since the epoch, shifted so buckets follow local time."""
+    offset = datetime.datetime.fromtimestamp(ts, TIMEZONE).utcoffset()
+    return int(ts + offset.total_seconds())
+
+def bucket_number(resolution, local):
+    size, _ = RESOLUTIONS[resolution]
+    if resolution == 'week':
+        # 1970-01-01 was a Thursday; start weeks on Monday
+        return (local + 3 * 86400) // size
+    return local // size
+
+class Counters:
+    """Ring of per-bucket counts for one device and resolution."""
+    __slots__ = ('counts', 'last')
+
+    def __init__(self, length, last=0, counts=None):
+        self.counts = array.array('I', counts if counts is not None else [0] * length)
+        self.last = last
+
+    def advance(self, bucket):
+        """Zero the buckets between the last used bucket and this one."""
+        length = len(self.counts)
+        if bucket > self.last:
+            for b in range(self.last + 1, min(bucket, self.last + length) + 1):
+                self.counts[b % length] = 0
+            self.last = bucket
+
+    def get(self, bucket):
+        """Return the count for a bucket, or 0 if it is out of range."""
+        if bucket > self.last or bucket <= self.last - len(self.counts):
+            return 0
+        return self.counts[bucket % len(self.counts)]
+
+    def add(self, other):
+        """Add the counts of other, which has the same length."""
+        self.advance(other.last)
+        for bucket in range(max(other.last, self.last) - len(self.counts) + 1, other.last + 1):
+            self.counts[bucket % len(self.counts)] += other.get(bucket)
+
+class UsageStats:
+    def __init__(self, path, logger, save_interval=60):
+        """
+        Initialize the UsageStats.
+
+        Counts events per device in fixed-size hour, day and week buckets
+        (local time), so queries never need to scan the logs. The counters
+        are saved to a JSON file when they have changed. Device names are
+        lower case.
+
+        Only the process that has called start() records events and saves
+        the file; in other server processes the counters are read-only and
+        loaded again when the file has been saved.
+
+        Args:
+            path: Path of the JSON file holding the counters
+            logger: Logger instance (optional)
+            save_interval: Seconds between saves
+        """
+        self.path = path
+        self.logger = logger
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        # device -> resolution -> Counters
+        self.devices = {}
+        self.dirty = False
+        # mtime of the file when it was last loaded
+        self.loaded = None
+        self.running = False
+        self.thread = None
+        self.load()
+
+    def log_info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.log_info(f"UsageStats: cannot load {self.path}: {e}")
+            return
+        devices = {}
+        for device, resolutions in saved.items():
+            loaded = {}
+            for resolution, (size, length) in RESOLUTIONS.items():
+                counters = resolutions.get(resolution)
+                if counters and len(counters['counts']) == length:
+                    loaded[resolution] = Counters(length, counters['last'], counters['counts'])
+                else:
+                    loaded[resolution] = Counters(length)
+            # Files from before names were lower-cased may spell a device
+            # several ways
+            device = device.lower()
+            if device in devices:
+                for resolution, counters in loaded.items():
+                    devices[device][resolution].add(counters)
+            else:
+                devices[device] = loaded
+        with self.lock:
+            self.devices = devices
+            self.loaded = mtime
+
+    def _refresh(self):
+        """Load the counters again if another process has saved them."""
+        if self.running:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.loaded:
+            self.load()
+
+    def save(self):
+        """Write the counters to disk if they have changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            saved = {
+                device: {
+                    resolution: { 'last': counters.last, 'counts': counters.counts.tolist() }
+                    for resolution, counters in resolutions.items()
+                }
+                for device, resolutions in self.devices.items()
+            }
+            self.dirty = False
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(saved, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def record(self, device, ts=None):
+        """Count one event for a device."""
+        device = device.lower()
+        local = local_seconds(time.time() if ts is None else ts)
+        with self.lock:
+            resolutions = self.devices.get(device)
+            if resolutions is None:
+                resolutions = self.devices[device] = {
+                    resolution: Counters(length) for resolution, (_, length) in RESOLUTIONS.items()
+                }
+            for resolution, counters in resolutions.items():
+                bucket = bucket_number(resolution, local)
+                counters.advance(bucket)
+                if bucket > counters.last - len(counters.counts):
+                    counters.counts[bucket % len(counters.counts)] += 1
+            self.dirty = True
+
+    def device_names(self):
+        self._refresh()
+        with self.lock:
+            return sorted(self.devices)
+
+    def recent(self, device, resolution, count, now=None):
+        """
+        Return [(bucket start, count)] for the last count buckets of a
+        device, oldest first. Bucket starts are naive local datetimes.
+        """
+        self._refresh()
+        size, length = RESOLUTIONS[resolution]
+        current = bucket_number(resolution, local_seconds(time.time() if now is None else now))
+        count = min(count, length)
+        with self.lock:
+            counters = self.devices.get(device, {}).get(resolution)
+            values = [counters.get(b) if counters else 0 for b in range(current - count + 1, current + 1)]
+        result = []
+        for i, value in enumerate(values):
+            bucket = current - count + 1 + i
+            start = bucket * size - (3 * 86400 if resolution == 'week' else 0)
+            result.append((datetime.datetime.fromtimestamp(start, datetime.timezone.utc).replace(tzinfo=None), value))
+        return result
+
+    def total(self, device, resolution, count, now=None):
+        """Return the number of events in the last count buckets of a device."""
+        return sum(value for _, value in self.recent(device, resolution, count, now))
+
+    def _save_loop(self):
+        """Main loop for the saver thread."""
+        while self.running:
+            time.sleep(self.save_interval)
+            try:
+                self.save()
+            except Exception as e:
+                self.log_info(f"UsageStats: cannot save {self.path}: {e}")
+
+    def start(self):
+        """Take over recording and start the saver thread."""
+        if self.running:
+            return
+        self.load()
+        self.running = True
+        self.thread = threading.Thread(target=self._save_loop, name="usage-stats", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the saver thread and save the counters."""
+        self.running = False
+        self.save()
@@ -0,0 +1,63 @@
+import socket
+import struct
+
+from gunicorn.app.base import BaseApplication
+
+class WsgiServer(BaseApplication):
+    def __init__(self, app, bind, workers, threads, on_worker_start=None, timeout=60):
+        """
+        Initialize the WsgiServer.
+
+        Serves a WSGI application with gunicorn: workers processes with
+        threads request threads each (the gthread worker). The application
+        is loaded before the workers are forked; anything that must not be
+        shared across a fork (threads, connections) is started per worker
+        by on_worker_start.
+
+        Args:
+            app: WSGI application
+            bind: Address to listen on, e.g. '0.0.0.0:5000'
+            workers: Number of worker processes
+            threads: Number of request threads per worker
+            on_worker_start: Function called in each worker process after it
+                             has started (optional)
+            timeout: Seconds a client may be idle on a kept-alive connection,
+                     and a single socket read or write may block
+        """
+        self.application = app
+        self.timeout = timeout
+        self.on_worker_start = on_worker_start
+        self.options = {
+            'bind': bind,
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'keepalive': timeout,
+            # Long-polls and downloads keep a thread busy; the worker
+            # heartbeat is independent of requests
+            'timeout': 120,
+            'graceful_timeout': 10,
+            'accesslog': None,
+            'post_worker_init': self._post_worker_init,
+        }
+        super().__init__()
+
+    def _post_worker_init(self, worker):
+        # gthread makes client sockets blocking without a timeout, so a
+        # client that stops reading would hold a request thread for good.
+        # Kernel send and receive timeouts set on the listeners are
+        # inherited by accepted connections, and apply to reading the
+        # request and writing the response alike.
+        timeval = struct.pack('ll', self.timeout, 0)
+        for listener in worker.sockets:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        if self.on_worker_start:
+            self.on_worker_start()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application